@@ -0,0 +1,38 @@
+# analyze.py
+
+import sys
+import json
+import argparse
+
+from cps_common.analysis import load_run, report, THROUGHPUT_BIN
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="KPIs of recorded runs")
+    argp.add_argument(
+        "runs", nargs="+", help="recorder or simulator output, .csv or .npz",
+    )
+    argp.add_argument(
+        "-bin",
+        action="store",
+        dest="bin",
+        default=THROUGHPUT_BIN,
+        help=f"seconds per throughput bin; default: {THROUGHPUT_BIN}",
+    )
+    argp.add_argument(
+        "-out", action="store", dest="out", default=None, help="default: stdout",
+    )
+
+    args = argp.parse_args()
+
+    reports = []
+    for path in args.runs:
+        columns, metadata = load_run(path)
+        reports.append(report(columns, dict(metadata, file=path), float(args.bin)))
+
+    if args.out is None:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.out, "w") as f:
+            json.dump(reports, f, indent=2)
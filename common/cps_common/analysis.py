@@ -0,0 +1,196 @@
+# analysis.py
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+from cps_common.data import Passenger
+from cps_common.results import (
+    NPZ,
+    RESULT_COLUMNS,
+    NO_TIMESTAMP,
+    load_results,
+    passengers_to_columns,
+)
+
+# percentiles in the report, nearest-rank
+PERCENTILES = [50, 95, 99]
+STATS = ["count", "mean"] + [f"p{q}" for q in PERCENTILES] + ["max"]
+# seconds per bin of the throughput over time
+THROUGHPUT_BIN = 60
+
+Columns = Dict[str, np.ndarray]
+
+
+def load_run(path: str) -> Tuple[Columns, dict]:
+    """
+    Loads recorder or simulator output, CSV or .npz.
+
+    :return: the int64 array of each of RESULT_COLUMNS and the run metadata
+    """
+    if path.endswith("." + NPZ):
+        return load_results(path)
+    return load_csv(path), {}
+
+
+def load_csv(path: str) -> Columns:
+    """Loads a recorder CSV with ISO timestamps into the columns of a .npz."""
+    with open(path) as f:
+        header = f.readline().strip().split(",")
+        rows = f.readline().strip()
+    if not rows:
+        # a run without arrived passengers only has the header
+        return {name: np.empty(0, dtype=np.int64) for name in RESULT_COLUMNS}
+    table = np.loadtxt(
+        path, dtype=str, delimiter=",", skiprows=1, ndmin=2, comments=None
+    )
+    fields = {name: table[:, i] for i, name in enumerate(header)}
+
+    columns = {
+        "id": fields["id"].astype(np.int64),
+        "start_floor": fields["start_floor"].astype(np.int64),
+        "end_floor": fields["end_floor"].astype(np.int64),
+    }
+    for name in ["start", "enter_elevator", "leave_elevator", "end"]:
+        # empty timestamps become NaT, which is NO_TIMESTAMP as int64
+        timestamps = fields[name + "_timestamp"].astype("datetime64[ns]")
+        columns[name + "_ns"] = timestamps.astype(np.int64)
+    return columns
+
+
+def columns_from_passengers(passengers: List[Passenger]) -> Columns:
+    block = passengers_to_columns(passengers)
+    return {name: block[i] for i, name in enumerate(RESULT_COLUMNS)}
+
+
+def _seconds(later: np.ndarray, earlier: np.ndarray) -> np.ndarray:
+    # NaN where either timestamp is missing
+    missing = (later == NO_TIMESTAMP) | (earlier == NO_TIMESTAMP)
+    return np.where(missing, np.nan, (later - earlier) / 1e9)
+
+
+def durations(columns: Columns) -> Dict[str, np.ndarray]:
+    """:return: wait, ride and journey time of each passenger in seconds"""
+    return {
+        "wait": _seconds(columns["enter_elevator_ns"], columns["start_ns"]),
+        "ride": _seconds(columns["leave_elevator_ns"], columns["enter_elevator_ns"]),
+        "journey": _seconds(columns["end_ns"], columns["start_ns"]),
+    }
+
+
+def stats(values: np.ndarray) -> dict:
+    """:return: count, mean, percentiles and max of the values that aren't NaN"""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return dict.fromkeys(STATS) | {"count": 0}
+    result = {"count": int(len(values)), "mean": float(values.mean())}
+    for q, v in zip(
+        PERCENTILES, np.percentile(values, PERCENTILES, method="inverted_cdf")
+    ):
+        result[f"p{q}"] = float(v)
+    result["max"] = float(values.max())
+    return result
+
+
+def grouped_stats(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, dict]:
+    """
+    Same as stats() for each group of values with the same key.
+
+    :return: the sorted distinct keys and a dict of arrays with one entry per key
+    """
+    valid = ~np.isnan(values)
+    keys, values = keys[valid], values[valid]
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+
+    groups, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    if len(groups) == 0:
+        return groups, {name: counts for name in STATS}
+
+    result = {"count": counts}
+    result["mean"] = np.add.reduceat(values, first) / counts
+    for q in PERCENTILES:
+        # nearest rank within the sorted values of each group
+        rank = np.maximum(1, np.ceil(counts * q / 100).astype(np.int64))
+        result[f"p{q}"] = values[first + rank - 1]
+    result["max"] = values[first + counts - 1]
+    return groups, result
+
+
+def _group_rows(groups: np.ndarray, result: dict) -> List[dict]:
+    return [
+        {name: column[i].item() for name, column in result.items()}
+        for i in range(len(groups))
+    ]
+
+
+def per_floor(columns: Columns, times: Dict[str, np.ndarray]) -> List[dict]:
+    """:return: the wait and journey stats by start floor"""
+    floors = columns["start_floor"]
+    rows = {}
+    for name in ["wait", "journey"]:
+        groups, result = grouped_stats(floors, times[name])
+        for floor, row in zip(groups.tolist(), _group_rows(groups, result)):
+            rows.setdefault(floor, {"floor": floor})[name] = row
+    return [rows[f] for f in sorted(rows)]
+
+
+def origin_destination(columns: Columns, times: Dict[str, np.ndarray]) -> List[dict]:
+    """:return: the wait and journey stats by start and end floor"""
+    floor_count = max(columns["start_floor"].max(), columns["end_floor"].max()) + 1
+    keys = columns["start_floor"] * floor_count + columns["end_floor"]
+    rows = {}
+    for name in ["wait", "journey"]:
+        groups, result = grouped_stats(keys, times[name])
+        for key, row in zip(groups.tolist(), _group_rows(groups, result)):
+            start, end = divmod(key, int(floor_count))
+            rows.setdefault(key, {"start": start, "end": end})[name] = row
+    return [rows[k] for k in sorted(rows)]
+
+
+def throughput(columns: Columns, bin_seconds: float = THROUGHPUT_BIN) -> dict:
+    """:return: the number of passengers arriving at their destination per bin"""
+    start, end = columns["start_ns"], columns["end_ns"]
+    start, end = start[start != NO_TIMESTAMP], end[end != NO_TIMESTAMP]
+    if len(start) == 0 or len(end) == 0:
+        return {"bin_seconds": bin_seconds, "arrived": [], "peak": 0}
+    bins = ((end - start.min()) // int(bin_seconds * 1e9)).astype(np.int64)
+    arrived = np.bincount(np.maximum(bins, 0))
+    return {
+        "bin_seconds": bin_seconds,
+        "arrived": arrived.tolist(),
+        "peak": int(arrived.max()),
+    }
+
+
+def summary(columns: Columns) -> dict:
+    """:return: the overall wait, ride and journey stats"""
+    return {name: stats(values) for name, values in durations(columns).items()}
+
+
+def report(
+    columns: Columns, metadata: dict = None, bin_seconds: float = THROUGHPUT_BIN
+) -> dict:
+    """:return: all KPIs of a run as JSON serializable dict"""
+    times = durations(columns)
+    start, end = columns["start_ns"], columns["end_ns"]
+    arrived = end != NO_TIMESTAMP
+    makespan: Optional[float] = None
+    if arrived.any():
+        first = start[start != NO_TIMESTAMP].min()
+        makespan = float((end[arrived].max() - first) / 1e9)
+
+    result = {
+        "metadata": metadata or {},
+        "passengers": int(len(columns["id"])),
+        "arrived": int(arrived.sum()),
+        "makespan": makespan,
+    }
+    result.update({name: stats(values) for name, values in times.items()})
+    if len(columns["id"]):
+        result["per_floor"] = per_floor(columns, times)
+        result["origin_destination"] = origin_destination(columns, times)
+    else:
+        result["per_floor"] = []
+        result["origin_destination"] = []
+    result["throughput"] = throughput(columns, bin_seconds)
+    return result
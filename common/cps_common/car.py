@@ -0,0 +1,70 @@
+# car.py
+
+from typing import List, Optional, Set
+from cps_common.data import Passenger
+
+
+class Car:
+    """
+    Movement and load state of a single elevator car, without any transport.
+
+    The elevator service drives this from its threads and MQTT callbacks; the
+    in-process simulation calls it directly.
+    """
+
+    def __init__(self, id: int, start_floor: int = 0, max_cap: int = 20):
+        self.id = id
+        self.maxCap = max_cap
+        self.actualCap = 0
+        self.destinations = set()
+        self.nextFloor = start_floor
+        self.currentFloor = 0
+        self.door_status = "open"
+        self.passenger_list: List[Passenger] = []
+
+    def set_next_floor(self, next_floor: int) -> bool:
+        """:return: True if the car has a new target floor"""
+        if self.nextFloor != next_floor:
+            self.nextFloor = next_floor
+            self.destinations.add(next_floor)
+            return True
+        return False
+
+    def board(self, passengers: List[Passenger], timestamp: int = None) -> Set[int]:
+        """
+        Takes the passengers into the car.
+
+        :return: the floors selected by all passengers inside the car
+        """
+        for p in passengers:
+            p.log_enter_elevator(timestamp)
+            self.destinations.add(p.end_floor)
+            self.passenger_list.append(p)
+            self.actualCap += 1
+
+        return set([p.end_floor for p in self.passenger_list])
+
+    def step(self, timestamp: int = None) -> Optional[List[Passenger]]:
+        """
+        Moves the car one floor towards the next floor.
+
+        :return: the passengers leaving the car if it arrived at the next floor,
+            otherwise None
+        """
+        self.door_status = "closed"
+        if self.currentFloor > self.nextFloor:
+            self.currentFloor -= 1
+        elif self.currentFloor < self.nextFloor:
+            self.currentFloor += 1
+
+        if self.currentFloor != self.nextFloor:
+            return None
+
+        leaving = [p for p in self.passenger_list if p.end_floor == self.currentFloor]
+        self.passenger_list = [p for p in self.passenger_list if p not in leaving]
+        for p in leaving:
+            p.log_leave_elevator(timestamp)
+            self.actualCap -= 1
+        self.destinations.discard(self.currentFloor)
+        self.door_status = "open"
+        return leaving
@@ -0,0 +1,137 @@
+# clock.py
+
+import json
+import time
+import logging
+
+from datetime import datetime, timedelta
+
+# retained message with the clock every service in broker mode follows
+CLOCK_TOPIC = "simulation/clock"
+
+# clock sources
+LOCAL = "local"
+BROKER = "broker"
+
+# integer timestamps are nanoseconds since this, in the same time base as the
+# naive datetimes of the simulation time
+EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime_to_ns(value: datetime) -> int:
+    return (value - EPOCH) // _MICROSECOND * 1000
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    return EPOCH + (ns // 1000) * _MICROSECOND
+
+
+class Clock:
+    """
+    Simulation time running `scale` times faster than the wall clock.
+
+    The simulation time starts at `epoch` when the wall clock is at `started`
+    (unix time). With the defaults this is the plain wall clock.
+    """
+
+    def __init__(
+        self, scale: float = 1, epoch: datetime = None, started: float = None
+    ):
+        self.scale = float(scale)
+        self.started = started if started is not None else time.time()
+        self.epoch = (
+            epoch if epoch is not None else datetime.fromtimestamp(self.started)
+        )
+        self._epoch_ns = datetime_to_ns(self.epoch)
+
+    def now(self) -> datetime:
+        return self.epoch + timedelta(seconds=(time.time() - self.started) * self.scale)
+
+    def now_ns(self) -> int:
+        """
+        Same as now(), as integer nanoseconds since EPOCH with the microsecond
+        resolution of datetime, so it converts to ISO strings and back.
+        """
+        elapsed = (time.time() - self.started) * self.scale
+        return self._epoch_ns + int(elapsed * 1e6) * 1000
+
+    def to_wall(self, seconds: float) -> float:
+        """Converts a duration in simulation time to wall clock seconds."""
+        return seconds / self.scale
+
+    def sleep(self, seconds: float):
+        time.sleep(self.to_wall(seconds))
+
+    def to_dict(self):
+        return {
+            "scale": self.scale,
+            "epoch": self.epoch.isoformat(),
+            "started": self.started,
+        }
+
+    @staticmethod
+    def from_dict(c: dict):
+        return Clock(
+            scale=c["scale"],
+            epoch=datetime.fromisoformat(c["epoch"]),
+            started=c["started"],
+        )
+
+
+_clock = Clock()
+_source = LOCAL
+
+
+def configure(scale: float = 1, source: str = LOCAL):
+    """
+    Sets the clock of this service.
+
+    :param scale: how much faster than the wall clock the simulation runs
+    :param source: LOCAL to use the given scale, BROKER to follow the clock
+        published on CLOCK_TOPIC once subscribed
+    """
+    global _clock, _source
+    if source not in (LOCAL, BROKER):
+        raise ValueError(f"unknown clock source: {source}")
+    _clock = Clock(scale=scale)
+    _source = source
+
+
+def get_clock() -> Clock:
+    return _clock
+
+
+def now() -> datetime:
+    return _clock.now()
+
+
+def now_ns() -> int:
+    return _clock.now_ns()
+
+
+def to_wall(seconds: float) -> float:
+    return _clock.to_wall(seconds)
+
+
+def sleep(seconds: float):
+    _clock.sleep(seconds)
+
+
+def subscribe(client):
+    """Follows the clock published on the broker if configured to do so."""
+    if _source != BROKER:
+        return
+    client.subscribe(CLOCK_TOPIC, qos=1)
+    client.message_callback_add(CLOCK_TOPIC, on_clock)
+
+
+def publish(client):
+    """Publishes this clock for all services in broker mode."""
+    client.publish(CLOCK_TOPIC, json.dumps(_clock.to_dict()), qos=1, retain=True)
+
+
+def on_clock(client, userdata, msg):
+    global _clock
+    _clock = Clock.from_dict(json.loads(msg.payload))
+    logging.info(f"following broker clock: {_clock.to_dict()}")
@@ -1,10 +1,40 @@
 # data.py
 
 import json
+import struct
 
-from datetime import datetime
 from collections import deque
-from typing import Deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Union
+from cps_common import clock
+
+# default building size
+ELEVATOR_COUNT = 6
+FLOOR_COUNT = 10
+
+# columns of the passenger records written by the recorder
+RECORD_FIELDS = [
+    "id",
+    "start_floor",
+    "end_floor",
+    "start_timestamp",
+    "enter_elevator_timestamp",
+    "leave_elevator_timestamp",
+    "end_timestamp",
+]
+
+# passenger timestamp, integer nanoseconds since clock.EPOCH or an ISO string
+Timestamp = Union[int, str, None]
+
+# encoding of passenger lists on the simulation and record topics
+JSON = "json"
+# columnar batch of struct packed integers, see pack_passengers
+BINARY = "binary"
+
+# version of the elevator/{id}/state message, increased on incompatible changes
+ELEVATOR_STATE_VERSION = 1
+# fields of the elevator/{id}/state message, a missing field didn't change
+ELEVATOR_STATE_FIELDS = ["status", "floor", "door", "actual", "max"]
 
 
 class ElevatorData:
@@ -28,18 +58,38 @@ class FloorData:
         self.waiting_count = 0
         self.up_pressed = False
         self.down_pressed = False
+        # waiting passengers by destination floor, used in destination mode
+        self.destinations: Dict[int, int] = {}
 
 
 class Passenger:
+    """
+    A passenger with the times it passed each step of its journey.
+
+    The timestamps are stored as integer nanoseconds since clock.EPOCH; the
+    *_timestamp properties convert them to the ISO strings used in JSON and the
+    recorded CSV.
+    """
+
+    __slots__ = (
+        "id",
+        "start_floor",
+        "end_floor",
+        "start_ns",
+        "enter_elevator_ns",
+        "leave_elevator_ns",
+        "end_ns",
+    )
+
     def __init__(
         self,
         id: int,
         start_floor: int,
         end_floor: int,
-        start_timestamp: str = None,
-        end_timestamp: str = None,
-        enter_elevator: str = None,
-        leave_elevator: str = None,
+        start_timestamp: Timestamp = None,
+        end_timestamp: Timestamp = None,
+        enter_elevator: Timestamp = None,
+        leave_elevator: Timestamp = None,
     ):
         # Mandatory values. This must be given at initilisation
         self.id: int = id
@@ -48,21 +98,28 @@ class Passenger:
 
         # Overwrite default values if specified
         if start_timestamp is not None:
-            self.start_timestamp = start_timestamp
-        else:
-            self.start_timestamp: str = datetime.now().isoformat()
-        if end_timestamp is not None:
-            self.end_timestamp = end_timestamp
-        else:
-            self.end_timestamp: str = None
-        if enter_elevator is not None:
-            self.enter_elevator_timestamp = enter_elevator
+            self.start_ns: int = _to_ns(start_timestamp)
         else:
-            self.enter_elevator_timestamp: str = None
-        if leave_elevator is not None:
-            self.leave_elevator_timestamp = leave_elevator
-        else:
-            self.leave_elevator_timestamp: str = None
+            self.start_ns: int = clock.now_ns()
+        self.end_ns: Optional[int] = _to_ns(end_timestamp)
+        self.enter_elevator_ns: Optional[int] = _to_ns(enter_elevator)
+        self.leave_elevator_ns: Optional[int] = _to_ns(leave_elevator)
+
+    @property
+    def start_timestamp(self) -> Optional[str]:
+        return _to_iso(self.start_ns)
+
+    @property
+    def end_timestamp(self) -> Optional[str]:
+        return _to_iso(self.end_ns)
+
+    @property
+    def enter_elevator_timestamp(self) -> Optional[str]:
+        return _to_iso(self.enter_elevator_ns)
+
+    @property
+    def leave_elevator_timestamp(self) -> Optional[str]:
+        return _to_iso(self.leave_elevator_ns)
 
     def __eq__(self, value):
         if not isinstance(value, Passenger):
@@ -72,38 +129,25 @@ class Passenger:
             self.id == value.id
             and self.start_floor == value.start_floor
             and self.end_floor == value.end_floor
-            and self.start_timestamp == value.start_timestamp
-            and self.end_timestamp == value.end_timestamp
-            and self.enter_elevator_timestamp == value.enter_elevator_timestamp
-            and self.leave_elevator_timestamp == value.leave_elevator_timestamp
+            and self.start_ns == value.start_ns
+            and self.end_ns == value.end_ns
+            and self.enter_elevator_ns == value.enter_elevator_ns
+            and self.leave_elevator_ns == value.leave_elevator_ns
         )
 
     def __repr__(self):
-        return json.dumps(self, cls=PassengerEncoder)
+        return f"Passenger({self.id}, {self.start_floor} -> {self.end_floor})"
 
     @staticmethod
     def from_json_dict(p: dict):
-        enter_elevator = None
-        leave_elevator = None
-        end = None
-        start = None
-
-        if "enter_elevator_timestamp" in p.keys():
-            enter_elevator = p["enter_elevator_timestamp"]
-        if "leave_elevator_timestamp" in p.keys():
-            leave_elevator = p["leave_elevator_timestamp"]
-        if "end_timestamp" in p.keys():
-            end = p["end_timestamp"]
-        if "start_timestamp" in p.keys():
-            start = p["start_timestamp"]
         return Passenger(
             id=p["id"],
             start_floor=p["start_floor"],
             end_floor=p["end_floor"],
-            start_timestamp=start,
-            end_timestamp=end,
-            enter_elevator=enter_elevator,
-            leave_elevator=leave_elevator,
+            start_timestamp=p.get("start_timestamp"),
+            end_timestamp=p.get("end_timestamp"),
+            enter_elevator=p.get("enter_elevator_timestamp"),
+            leave_elevator=p.get("leave_elevator_timestamp"),
         )
 
     def to_dict(self):
@@ -112,24 +156,39 @@ class Passenger:
             "start_floor": self.start_floor,
             "end_floor": self.end_floor,
         }
-        if self.start_timestamp is not None:
+        if self.start_ns is not None:
             result["start_timestamp"] = self.start_timestamp
-        if self.end_timestamp is not None:
+        if self.end_ns is not None:
             result["end_timestamp"] = self.end_timestamp
-        if self.enter_elevator_timestamp is not None:
+        if self.enter_elevator_ns is not None:
             result["enter_elevator_timestamp"] = self.enter_elevator_timestamp
-        if self.leave_elevator_timestamp is not None:
+        if self.leave_elevator_ns is not None:
             result["leave_elevator_timestamp"] = self.leave_elevator_timestamp
         return result
 
-    def log_end(self):
-        self.end_timestamp = datetime.now().isoformat()
+    def log_end(self, timestamp: int = None):
+        """:param timestamp: nanoseconds since clock.EPOCH, default: now"""
+        self.end_ns = timestamp if timestamp is not None else clock.now_ns()
+
+    def log_enter_elevator(self, timestamp: int = None):
+        """:param timestamp: nanoseconds since clock.EPOCH, default: now"""
+        self.enter_elevator_ns = timestamp if timestamp is not None else clock.now_ns()
 
-    def log_enter_elevator(self):
-        self.enter_elevator_timestamp = datetime.now().isoformat()
+    def log_leave_elevator(self, timestamp: int = None):
+        """:param timestamp: nanoseconds since clock.EPOCH, default: now"""
+        self.leave_elevator_ns = timestamp if timestamp is not None else clock.now_ns()
 
-    def log_leave_elevator(self):
-        self.leave_elevator_timestamp = datetime.now().isoformat()
+
+def _to_ns(timestamp: Timestamp) -> Optional[int]:
+    if timestamp is None or isinstance(timestamp, int):
+        return timestamp
+    return clock.datetime_to_ns(datetime.fromisoformat(timestamp))
+
+
+def _to_iso(ns: Optional[int]) -> Optional[str]:
+    if ns is None:
+        return None
+    return clock.ns_to_datetime(ns).isoformat()
 
 
 class PassengerEncoder(json.JSONEncoder):
@@ -138,3 +197,131 @@ class PassengerEncoder(json.JSONEncoder):
             return obj.to_dict()
         # let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, obj)
+
+
+# header of a binary passenger batch: magic, version and passenger count
+_BATCH_HEADER = struct.Struct("<2sBI")
+_BATCH_MAGIC = b"PB"
+_BATCH_VERSION = 2
+_NO_TIMESTAMP = -(2 ** 63)
+
+
+def _to_column(ns: Optional[int]) -> int:
+    return _NO_TIMESTAMP if ns is None else ns
+
+
+def _from_column(value: int) -> Optional[int]:
+    return None if value == _NO_TIMESTAMP else value
+
+
+def pack_passengers(passengers: List[Passenger]) -> bytes:
+    """
+    Packs passengers into a binary batch.
+
+    After the header follow the columns of all passengers: ids (int64), start
+    and end floors (int32) and the start, enter elevator, leave elevator and end
+    timestamps (int64 nanoseconds since the epoch). Unlike the ISO strings of
+    the JSON codec, which have microseconds, the timestamps are kept exactly.
+    """
+    n = len(passengers)
+    columns = [p.id for p in passengers]
+    columns += [p.start_floor for p in passengers]
+    columns += [p.end_floor for p in passengers]
+    columns += [_to_column(p.start_ns) for p in passengers]
+    columns += [_to_column(p.enter_elevator_ns) for p in passengers]
+    columns += [_to_column(p.leave_elevator_ns) for p in passengers]
+    columns += [_to_column(p.end_ns) for p in passengers]
+    header = _BATCH_HEADER.pack(_BATCH_MAGIC, _BATCH_VERSION, n)
+    return header + struct.pack(f"<{n}q{2 * n}i{4 * n}q", *columns)
+
+
+def unpack_passengers(payload: bytes) -> List[Passenger]:
+    """
+    Unpacks a binary batch created by pack_passengers.
+
+    :raises ValueError: if the payload is no batch of this version
+    """
+    try:
+        magic, version, n = _BATCH_HEADER.unpack_from(payload)
+        if magic != _BATCH_MAGIC or version != _BATCH_VERSION:
+            raise ValueError("unsupported passenger batch")
+        values = struct.unpack_from(
+            f"<{n}q{2 * n}i{4 * n}q", payload, _BATCH_HEADER.size
+        )
+    except struct.error as e:
+        raise ValueError(f"truncated passenger batch: {e}")
+    ids, starts, ends = values[:n], values[n : 2 * n], values[2 * n : 3 * n]
+    start, enter, leave, end = (
+        values[(3 + i) * n : (4 + i) * n] for i in range(0, 4)
+    )
+    return [
+        Passenger(
+            id=ids[i],
+            start_floor=starts[i],
+            end_floor=ends[i],
+            start_timestamp=_from_column(start[i]),
+            enter_elevator=_from_column(enter[i]),
+            leave_elevator=_from_column(leave[i]),
+            end_timestamp=_from_column(end[i]),
+        )
+        for i in range(0, n)
+    ]
+
+
+def encode_passengers(
+    passengers: List[Passenger], codec: str = JSON
+) -> Union[str, bytes]:
+    """
+    Encodes a passenger list as JSON or as binary batch.
+
+    JSON has the timestamps as ISO strings with microseconds, as produced by
+    the clock; the binary batch keeps them in nanoseconds.
+    """
+    if codec == BINARY:
+        return pack_passengers(passengers)
+    if codec == JSON:
+        return json.dumps(passengers, cls=PassengerEncoder)
+    raise ValueError(f"unknown passenger codec {codec}")
+
+
+def decode_passengers(payload: Union[str, bytes]) -> List[Passenger]:
+    """Decodes a passenger list in any of the codecs."""
+    if isinstance(payload, bytes) and payload[:2] == _BATCH_MAGIC:
+        return unpack_passengers(payload)
+    return json.loads(payload, object_hook=Passenger.from_json_dict)
+
+
+def encode_elevator_state(**state) -> str:
+    """
+    Encodes the elevator/{id}/state message.
+
+    :param state: values of ELEVATOR_STATE_FIELDS
+    :return: compact JSON payload
+    """
+    message = {"v": ELEVATOR_STATE_VERSION}
+    for field in ELEVATOR_STATE_FIELDS:
+        if state.get(field) is not None:
+            message[field] = state[field]
+    return json.dumps(message, separators=(",", ":"))
+
+
+def decode_elevator_state(payload) -> dict:
+    """
+    Decodes the elevator/{id}/state message.
+
+    :return: the fields present in the message
+    :raises ValueError: if the payload is malformed or of another version
+    """
+    message = json.loads(payload)
+    if not isinstance(message, dict) or message.get("v") != ELEVATOR_STATE_VERSION:
+        raise ValueError("unsupported elevator state message")
+    return {f: message[f] for f in ELEVATOR_STATE_FIELDS if f in message}
+
+
+def parse_ids(value: str) -> List[int]:
+    """:return: the floor or elevator ids of a list like "0-4,7,9" """
+    ids = set()
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        ids.update(range(int(first), int(last or first) + 1))
+    return sorted(ids)
@@ -0,0 +1,160 @@
+# hall.py
+
+import random
+import itertools
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from cps_common.data import Passenger, ElevatorData, ELEVATOR_COUNT
+
+
+class Hall:
+    """
+    Waiting passengers of a single floor and its boarding rules, without any
+    transport.
+
+    The floor service drives this from its threads and MQTT callbacks; the
+    in-process simulation calls it directly.
+    """
+
+    def __init__(
+        self, id: int, elevator_count: int = ELEVATOR_COUNT, rng: random.Random = None
+    ):
+        self.floor: int = id
+
+        self.arrived_list: List[Passenger] = []
+        self.elevators: List[ElevatorData] = [
+            ElevatorData(id) for id in range(0, elevator_count)
+        ]
+        # elevator allocated by the controller to each destination floor in
+        # destination mode, empty if any elevator can be boarded
+        self.allocation: Dict[int, int] = {}
+
+        # waiting passengers as (arrival number, passenger) in boarding order,
+        # once in the queue of all passengers and once in their destination's
+        self._queue: Deque[Tuple[int, Passenger]] = deque()
+        self._buckets: Dict[int, Deque[Tuple[int, Passenger]]] = {}
+        # arrival numbers of passengers that boarded out of order, still in _queue
+        self._boarded: Set[int] = set()
+        self._arrivals = itertools.count()
+
+        self.waiting_count: int = 0
+        self._up_count: int = 0
+        self._down_count: int = 0
+
+        # module level random unless a seeded generator is given
+        self._rng = rng if rng is not None else random
+
+    @property
+    def waiting_list(self) -> List[Passenger]:
+        """:return: the waiting passengers, next to board first"""
+        return [p for n, p in self._queue if n not in self._boarded]
+
+    def add_waiting(self, passengers: List[Passenger]):
+        """
+        Queues arriving passengers behind the ones already waiting; passengers
+        arriving together board in random order.
+        """
+        passengers = list(passengers)
+        self._rng.shuffle(passengers)
+        for p in passengers:
+            entry = (next(self._arrivals), p)
+            self._queue.append(entry)
+            self._buckets.setdefault(p.end_floor, deque()).append(entry)
+
+            self.waiting_count += 1
+            if p.end_floor > self.floor:
+                self._up_count += 1
+            elif p.end_floor < self.floor:
+                self._down_count += 1
+
+    def _remove(self, p: Passenger):
+        bucket = self._buckets[p.end_floor]
+        if not bucket:
+            del self._buckets[p.end_floor]
+
+        self.waiting_count -= 1
+        if p.end_floor > self.floor:
+            self._up_count -= 1
+        elif p.end_floor < self.floor:
+            self._down_count -= 1
+
+    def board(self, elevator_id: int, door: str) -> Optional[List[Passenger]]:
+        """
+        Lets waiting passengers enter the elevator if it opened its door here.
+
+        :return: the passengers entering the elevator (might be empty when the
+            elevator is full), or None if the elevator can't be boarded
+        """
+        elevator = self.elevators[elevator_id]
+        if (elevator.floor != self.floor) or (
+            door != "open" or self.waiting_count == 0
+        ):
+            return None
+
+        free = max(0, elevator.max_capacity - elevator.actual_capacity)
+        if self.allocation:
+            enter_list = self.board_allocated(elevator_id, free)
+        else:
+            enter_list: List[Passenger] = []
+            while len(enter_list) < free and self.waiting_count > 0:
+                n, p = self._queue.popleft()
+                if n in self._boarded:
+                    self._boarded.discard(n)
+                    continue
+                # the first waiting passenger is first in its bucket too
+                self._buckets[p.end_floor].popleft()
+                self._remove(p)
+                enter_list.append(p)
+
+        if enter_list:
+            # counted until the elevator sends its new capacity
+            elevator.actual_capacity += len(enter_list)
+        return enter_list
+
+    def board_allocated(
+        self, elevator_id: int, free: int
+    ) -> Optional[List[Passenger]]:
+        """
+        Lets only the passengers allocated to the elevator enter it, the ones
+        waiting the longest first.
+
+        :return: the entering passengers, or None if none are allocated to it
+        """
+        buckets = [
+            self._buckets[d]
+            for d, e in self.allocation.items()
+            if e == elevator_id and d in self._buckets
+        ]
+        if not buckets:
+            return None
+
+        enter_list: List[Passenger] = []
+        while len(enter_list) < free and buckets:
+            bucket = min(buckets, key=lambda b: b[0][0])
+            n, p = bucket.popleft()
+            if not bucket:
+                buckets.remove(bucket)
+            self._boarded.add(n)
+            self._remove(p)
+            enter_list.append(p)
+
+        if len(self._boarded) > self.waiting_count:
+            # drop the passengers that boarded out of order from the queue
+            self._queue = deque(e for e in self._queue if e[0] not in self._boarded)
+            self._boarded.clear()
+        return enter_list
+
+    def arrive(self, passengers: List[Passenger], timestamp: int = None):
+        """Logs the end time of passengers arriving at this floor."""
+        for p in passengers:
+            p.log_end(timestamp)
+        self.arrived_list += passengers
+
+    def destination_demand(self) -> Dict[int, int]:
+        """:return: the number of waiting passengers by destination floor"""
+        return {d: len(bucket) for d, bucket in self._buckets.items()}
+
+    def call_buttons(self) -> Tuple[bool, bool]:
+        """:return: whether the up and down call buttons should be pressed"""
+        return self._up_count > 0, self._down_count > 0
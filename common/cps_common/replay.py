@@ -0,0 +1,104 @@
+# replay.py
+
+import csv
+import heapq
+import tempfile
+import itertools
+
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+from cps_common import clock
+
+# recorded passengers sorted in memory at once, longer traces are sorted in runs
+# on disk and merged
+RUN_SIZE = 100_000
+# passengers starting at the same floor within this many seconds are replayed
+# together, as the floors stamp the passengers of one batch one by one
+GROUP_WINDOW = 0.01
+
+# start time in nanoseconds since clock.EPOCH, start floor, end floor and id
+Row = Tuple[int, int, int, int]
+
+
+def read_trace(path: str) -> Iterator[Row]:
+    """:return: the recorded passengers of a recorder CSV in the order of the file"""
+    with open(path, newline="") as f:
+        for r in csv.DictReader(f):
+            if not r["start_timestamp"]:
+                continue
+            start = datetime.fromisoformat(r["start_timestamp"])
+            yield (
+                clock.datetime_to_ns(start),
+                int(r["start_floor"]),
+                int(r["end_floor"]),
+                int(r["id"]),
+            )
+
+
+def _read_run(f) -> Iterator[Row]:
+    for r in csv.reader(f):
+        yield tuple(int(v) for v in r)
+
+
+def sorted_trace(path: str, run_size: int = RUN_SIZE) -> Iterator[Row]:
+    """
+    :return: the recorded passengers of a recorder CSV by start time, holding at
+        most `run_size` of them in memory
+    """
+    rows = read_trace(path)
+    runs = []
+    try:
+        while True:
+            run = sorted(itertools.islice(rows, run_size))
+            if not runs and len(run) < run_size:
+                # the whole trace fits in memory
+                yield from run
+                return
+            if not run:
+                break
+            f = tempfile.TemporaryFile(mode="w+", newline="")
+            csv.writer(f).writerows(run)
+            f.seek(0)
+            runs.append(f)
+        yield from heapq.merge(*(_read_run(f) for f in runs))
+    finally:
+        for f in runs:
+            f.close()
+
+
+def replay_trace(
+    path: str, time_factor: float = 1
+) -> Iterator[Tuple[float, int, List[dict]]]:
+    """
+    Replays the passengers of a recorder CSV with their recorded start floors,
+    destinations and ids.
+
+    :param time_factor: multiplies the times between the recorded starts, e.g.
+        0.5 replays the trace with twice the traffic
+    :return: iterator of (time, start floor, passengers) entries like
+        timeline.timeline_entries in time order, the first passenger at time 0
+    """
+    first = None
+    group_offset, group_floor, passengers = None, None, []
+    for start_ns, start, end, id in sorted_trace(path):
+        if first is None:
+            first = start_ns
+        offset = (start_ns - first) / 1e9
+        if passengers and (
+            start != group_floor or offset - group_offset > GROUP_WINDOW
+        ):
+            yield group_offset * time_factor, group_floor, passengers
+            passengers = []
+        if not passengers:
+            group_offset, group_floor = offset, start
+        passengers.append({"id": id, "start": start, "destination": end})
+    if passengers:
+        yield group_offset * time_factor, group_floor, passengers
+
+
+def count_destinations(path: str) -> Dict[int, int]:
+    """:return: the number of recorded passengers by destination floor"""
+    counts = {}
+    for _, _, end, _ in read_trace(path):
+        counts[end] = counts.get(end, 0) + 1
+    return counts
@@ -0,0 +1,91 @@
+# results.py
+
+import json
+import zipfile
+import numpy as np
+
+from typing import Dict, List, Tuple
+from cps_common.data import Passenger
+
+# result file formats
+CSV = "csv"
+NPZ = "npz"
+
+RESULT_VERSION = 1
+# columns of the .npz results, ids and floors as int64 and timestamps as int64
+# nanoseconds since clock.EPOCH
+RESULT_COLUMNS = [
+    "id",
+    "start_floor",
+    "end_floor",
+    "start_ns",
+    "enter_elevator_ns",
+    "leave_elevator_ns",
+    "end_ns",
+]
+# value of timestamps that were never logged
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def passengers_to_columns(passengers: List[Passenger]) -> np.ndarray:
+    """:return: int64 array with one row for each of RESULT_COLUMNS"""
+    block = np.empty((len(RESULT_COLUMNS), len(passengers)), dtype=np.int64)
+    for i, name in enumerate(RESULT_COLUMNS):
+        values = (getattr(p, name) for p in passengers)
+        block[i] = [NO_TIMESTAMP if v is None else v for v in values]
+    return block
+
+
+class ResultWriter:
+    """
+    Writes passengers to a NumPy .npz file, one row group for each call of
+    write().
+
+    The file is a zip archive with a "metadata" member holding the run metadata
+    as JSON string and one "groupNNNNNN" int64 array of shape
+    (len(RESULT_COLUMNS), passengers) per row group. Every write() leaves a
+    complete archive behind, so the rows written so far survive a crash.
+    """
+
+    def __init__(self, path: str, metadata: dict = None):
+        """
+        :param metadata: run metadata like the scheduling mode and scenario
+        """
+        self.path = path
+        self._groups = 0
+        metadata = dict(metadata or {}, version=RESULT_VERSION, columns=RESULT_COLUMNS)
+        with zipfile.ZipFile(path, mode="x") as zf:
+            _write_array(zf, "metadata", np.array(json.dumps(metadata)))
+
+    def write(self, passengers: List[Passenger]):
+        if not passengers:
+            return
+        with zipfile.ZipFile(self.path, mode="a") as zf:
+            name = f"group{self._groups:06d}"
+            _write_array(zf, name, passengers_to_columns(passengers))
+        self._groups += 1
+
+
+def _write_array(zf: zipfile.ZipFile, name: str, array: np.ndarray):
+    with zf.open(name + ".npy", mode="w", force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def load_results(path: str) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    Loads a results file written by ResultWriter.
+
+    :return: the array of each column by name and the run metadata
+    :raises ValueError: if the file has an unknown version
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        metadata = json.loads(str(npz["metadata"]))
+        if metadata.get("version") != RESULT_VERSION:
+            raise ValueError(f"unsupported results version in {path}")
+        columns = metadata["columns"]
+        groups = sorted(f for f in npz.files if f.startswith("group"))
+        if groups:
+            block = np.concatenate([npz[g] for g in groups], axis=1)
+        else:
+            block = np.empty((len(columns), 0), dtype=np.int64)
+    return {name: block[i] for i, name in enumerate(columns)}, metadata
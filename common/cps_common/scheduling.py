@@ -0,0 +1,608 @@
+# scheduling.py
+
+import logging
+
+from typing import Dict, Iterable, List, Deque, Optional, Set, Tuple
+from collections import deque
+from cps_common.data import ElevatorData, FloorData, ELEVATOR_COUNT, FLOOR_COUNT
+
+
+# mode
+SMART = "smart"
+DUMB = "dumb"
+SMARTER_DUMB = "smarter_dumb"
+SMART_WITH_CAP = "smart_with_cap"
+ETA = "eta"
+DESTINATION = "destination"
+
+# in smart mode, the waiting count threshold to send multiple (>1) elevator to the floor
+MULTIPLE_ELEVATOR_THRESHOLD = 10
+# in smarter dumb mode, configure how many elevator can be sent per floor
+MAX_ELEVATOR_PER_FLOOR = 3
+
+# in eta and destination mode, estimated seconds to travel one floor and to stop
+# at a floor
+FLOOR_TRAVEL_TIME = 3
+STOP_TIME = 2
+# in eta mode, extra cost in seconds of sending a full elevator
+LOAD_PENALTY = 10
+
+# direction
+UP = "up"
+DOWN = "down"
+
+
+class Scheduler:
+    """
+    Scheduling state and decisions of the controller, without any transport.
+
+    The controller service feeds this with the values it receives over MQTT and
+    publishes the resulting queues; the in-process simulation calls it directly.
+
+    The elevator queues must only be changed through the queue_* methods, which
+    keep the index of assigned floors up to date. The set_* methods return
+    whether the state changed, so callers only need to schedule again then.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        elevator_count: int = ELEVATOR_COUNT,
+        floor_count: int = FLOOR_COUNT,
+        multiple_elevator_threshold: int = MULTIPLE_ELEVATOR_THRESHOLD,
+        max_elevator_per_floor: int = MAX_ELEVATOR_PER_FLOOR,
+    ):
+        self.mode = mode
+        self.multiple_elevator_threshold = multiple_elevator_threshold
+        self.max_elevator_per_floor = max_elevator_per_floor
+        self.elevators: List[ElevatorData] = [
+            ElevatorData(id) for id in range(0, elevator_count)
+        ]
+        self.floors: List[FloorData] = [FloorData(id) for id in range(0, floor_count)]
+
+        # number of elevators with the floor in their queue
+        self.assigned: List[int] = [0 for f in self.floors]
+        # floors with a pressed call button, by direction
+        self.hall_calls: Dict[str, Set[int]] = {UP: set(), DOWN: set()}
+
+        # in destination mode, the elevator allocated to the passengers waiting on
+        # each floor, by destination floor
+        self.allocations: List[Dict[int, int]] = [{} for f in self.floors]
+        # floors with allocations, by elevator
+        self.allocated_floors: List[Set[int]] = [set() for e in self.elevators]
+        # floors whose allocation changed since it was last sent to the floor
+        self.changed_allocations: Set[int] = set()
+        # floors with waiting passengers by destination
+        self.demand_floors: Set[int] = set()
+
+    def queue_append(self, elevator: ElevatorData, floor: int):
+        elevator.queue.append(floor)
+        self.assigned[floor] += 1
+
+    def queue_insert(self, elevator: ElevatorData, index: int, floor: int):
+        elevator.queue.insert(index, floor)
+        self.assigned[floor] += 1
+
+    def queue_popleft(self, elevator: ElevatorData) -> int:
+        floor = elevator.queue.popleft()
+        self.assigned[floor] -= 1
+        return floor
+
+    def queue_replace(self, elevator: ElevatorData, floors: Iterable[int]):
+        for f in elevator.queue:
+            self.assigned[f] -= 1
+        elevator.queue = deque(floors)
+        for f in elevator.queue:
+            self.assigned[f] += 1
+
+    def get_called_floors(self) -> List[FloorData]:
+        """:return: the floors with a pressed call button, lowest first"""
+        called = self.hall_calls[UP] | self.hall_calls[DOWN]
+        return [self.floors[f] for f in sorted(called)]
+
+    def set_elevator_status(self, id: int, status: str) -> bool:
+        changed = self.elevators[id].status != status
+        self.elevators[id].status = status
+        return changed
+
+    def set_elevator_floor(self, id: int, floor: int) -> bool:
+        elevator = self.elevators[id]
+        changed = elevator.floor != floor
+        elevator.floor = floor
+        if elevator.old_floor != elevator.floor:
+            elevator.old_floor = elevator.floor
+
+        if elevator.floor > elevator.old_floor:
+            elevator.direction = UP
+        elif elevator.floor < elevator.old_floor:
+            elevator.direction = DOWN
+
+        if elevator.queue and elevator.floor == elevator.queue[0]:
+            # resets call button when an elevator is driving in that direction
+            floor = self.floors[elevator.floor]
+            if elevator.direction == UP:
+                floor.up_pressed = False
+                self.hall_calls[UP].discard(floor.id)
+            elif elevator.direction == DOWN:
+                floor.down_pressed = False
+                self.hall_calls[DOWN].discard(floor.id)
+
+            self.queue_popleft(elevator)
+            changed = True
+
+        if changed:
+            self.release_allocations(elevator)
+        return changed
+
+    def set_elevator_door(self, id: int, door: str) -> bool:
+        changed = self.elevators[id].door != door
+        self.elevators[id].door = door
+        return changed
+
+    def set_elevator_capacity(self, id: int, actual: int, max: int) -> bool:
+        elevator = self.elevators[id]
+        changed = (elevator.actual_capacity, elevator.max_capacity) != (actual, max)
+        elevator.actual_capacity = actual
+        elevator.max_capacity = max
+        return changed
+
+    def set_floor_waiting_count(self, id: int, count: int) -> bool:
+        changed = self.floors[id].waiting_count != count
+        self.floors[id].waiting_count = count
+        return changed
+
+    def set_floor_destinations(self, id: int, destinations: Dict[int, int]) -> bool:
+        floor = self.floors[id]
+        destinations = {int(d): c for d, c in destinations.items() if c > 0}
+        changed = floor.destinations != destinations
+        floor.destinations = destinations
+
+        if destinations:
+            self.demand_floors.add(id)
+        else:
+            self.demand_floors.discard(id)
+        return changed
+
+    def set_floor_button(self, id: int, direction: str, value: bool) -> bool:
+        floor = self.floors[id]
+        if direction == UP:
+            floor.up_pressed = value
+        elif direction == DOWN:
+            floor.down_pressed = value
+        else:
+            logging.warning("unknown button direction received")
+            return False
+
+        calls = self.hall_calls[direction]
+        changed = (id in calls) != value
+        if value:
+            calls.add(id)
+        else:
+            calls.discard(id)
+        return changed
+
+    def add_selected_floors(self, id: int, selected: List[int]) -> ElevatorData:
+        elevator = self.elevators[id]
+        if elevator.actual_capacity < elevator.max_capacity:
+            for f in selected:
+                if f not in elevator.queue:
+                    self.queue_append(elevator, f)
+        else:
+            logging.debug(
+                f"clearing elevator {elevator.id} queue; added {selected} to queue"
+            )
+            # ignore calling floor, send passenger in elevator first
+            self.queue_replace(elevator, selected)
+
+        # sorting only reorders the queue, the index stays the same
+        elevator.queue = self.sort_queue(
+            elevator.direction, elevator.floor, elevator.queue
+        )
+        return elevator
+
+    def sort_queue(
+        self, direction: str, current_floor: int, q: Deque[int]
+    ) -> Deque[int]:
+        # to sort: [8, 1, 6, 7, 2, 3]
+        # current floor: 5
+        # upper: [6, 7, 8]
+        # lower: [3, 2, 1]
+        # if direction UP: [6, 7, 8, 3, 2, 1]
+        # if direction DOWN: [3, 2, 1, 6, 7, 8]
+
+        # check queue empty
+        if not q:
+            logging.warning("queue to sort is empty")
+            return q
+
+        # separate the queue to upper and lower floor compared to the current floor
+        upper = sorted([f for f in q if f > current_floor])
+        # reverse lower because when at higher floor we want to go down
+        # e.g. current: 9; queue: [8, 7, 6] not [6, 7, 8]
+        lower = sorted([f for f in q if f < current_floor])
+        lower.reverse()
+
+        # if at lowest floor
+        if not lower:
+            return deque(upper)
+        # or at highest floor
+        if not upper:
+            return deque(lower)
+        # else we need to combine both upper and lower
+        if direction == "UP":
+            return deque(upper + lower)
+        else:
+            return deque(lower + upper)
+
+    def try_get_idle_elevator(self) -> ElevatorData:
+        # try get elevator with empty queue
+        for e in self.elevators:
+            if len(e.queue) == 0:
+                return e
+        return None
+
+    def try_get_empty_elevator(self):
+        # an elevator without passengers can drop its queue, unless it is on its
+        # way to a hall call, which would only be taken from it again
+        for e in self.elevators:
+            if e.actual_capacity == 0 and not any(self.is_called(f) for f in e.queue):
+                return e
+        return None
+
+    def is_called(self, floor: int) -> bool:
+        return floor in self.hall_calls[UP] or floor in self.hall_calls[DOWN]
+
+    def get_nearest_elevator(self, source_floor: int) -> ElevatorData:
+        # TODO: direction of elevator important?
+        # TODO: only return if elevator not full (max_cap < 20)
+        # of the elevators at the same distance the one with the fewest stops
+        return min(
+            self.elevators, key=lambda e: (abs(e.floor - source_floor), len(e.queue))
+        )
+
+    def select_elevator(self, source_floor: int) -> Tuple[ElevatorData, bool]:
+        """:return: the elevator and whether it drops its queue for the floor"""
+        elevator = self.try_get_idle_elevator()
+        if elevator is not None:
+            return elevator, False
+
+        elevator = self.try_get_empty_elevator()
+        if elevator is not None:
+            return elevator, True
+
+        # no elevator with empty queue
+        return self.get_nearest_elevator(source_floor), False
+
+    def get_called_floor_dumb(self, called: List[FloorData]) -> int:
+        for f in called:
+            if self.assigned[f.id] > 0 or f.waiting_count == 0:
+                continue
+            return f.id
+        return None
+
+    def get_called_floor_smarter_dumb(self, called: List[FloorData]) -> int:
+        for f in called:
+            if (
+                self.assigned[f.id] > self.max_elevator_per_floor
+                or f.waiting_count == 0
+            ):
+                continue
+            return f.id
+        return None
+
+    def get_called_floor_smart_with_cap(self, called: List[FloorData]) -> int:
+        pressed_floors = []
+        for f in called:
+            if (
+                self.assigned[f.id] > self.max_elevator_per_floor
+                or f.waiting_count == 0
+            ):
+                continue
+            if f.waiting_count > 0:
+                pressed_floors.append({"id": f.id, "count": f.waiting_count})
+        max_count = max(pressed_floors, default=None, key=compare_waiting_count)
+        if max_count is not None:
+            # logging.debug(f"max_count floor: {max_count}")
+            return max_count["id"]
+        return None
+
+    def get_called_floor_smart(self, called: List[FloorData]) -> int:
+        pressed_floors = []
+        for f in called:
+            if (
+                self.assigned[f.id] > 0
+                and f.waiting_count <= self.multiple_elevator_threshold
+            ):
+                continue
+            if f.waiting_count > 0:
+                pressed_floors.append({"id": f.id, "count": f.waiting_count})
+        max_count = max(pressed_floors, default=None, key=compare_waiting_count)
+        if max_count is not None:
+            # logging.debug(f"max_count floor: {max_count}")
+            return max_count["id"]
+        return None
+
+    def get_stops(self, elevator: ElevatorData) -> List[int]:
+        # an elevator waiting with open door is boarding at its current floor first
+        stops = list(elevator.queue)
+        if elevator.door == "open" and elevator.floor not in stops:
+            stops.insert(0, elevator.floor)
+        return stops
+
+    def get_expected_pickups(self, stops: List[List[int]]) -> List[int]:
+        """
+        :param stops: the stops of each elevator, see get_stops
+        :return: the passengers each floor is expected to hand over to the
+            elevators that already stop there, filling each elevator in the order
+            of its queue
+        """
+        pickups = [0 for f in self.floors]
+        for e in self.elevators:
+            free = e.max_capacity - e.actual_capacity
+            for f in stops[e.id]:
+                take = min(free, max(0, self.floors[f].waiting_count - pickups[f]))
+                pickups[f] += take
+                free -= take
+        return pickups
+
+    def estimate_arrival(
+        self, elevator: ElevatorData, source_floor: int
+    ) -> Tuple[float, int, int]:
+        """
+        Estimates when the elevator can serve a hall call, following its queue.
+
+        :return: the estimated time in seconds, the queue index to insert the
+            source floor at and the free capacity expected at the source floor
+        """
+        floor = self.floors[source_floor]
+        position = elevator.floor
+        elapsed = 0
+        free = elevator.max_capacity - elevator.actual_capacity
+        if elevator.door == "closed" and elevator.queue:
+            # the elevator is already moving towards the next floor in its queue,
+            # unless it is still at that floor
+            if elevator.queue[0] != position:
+                position += 1 if elevator.queue[0] > position else -1
+                elapsed += FLOOR_TRAVEL_TIME / 2
+
+        for i, stop in enumerate(elevator.queue):
+            # only stop on the way if the passengers travel in the same direction
+            on_the_way = min(position, stop) <= source_floor <= max(position, stop)
+            going_up = stop > position
+            if on_the_way and (floor.up_pressed if going_up else floor.down_pressed):
+                elapsed += abs(source_floor - position) * FLOOR_TRAVEL_TIME
+                return elapsed, i, free
+            elapsed += abs(stop - position) * FLOOR_TRAVEL_TIME + STOP_TIME
+            free -= min(free, self.floors[stop].waiting_count)
+            position = stop
+
+        elapsed += abs(source_floor - position) * FLOOR_TRAVEL_TIME
+        return elapsed, len(elevator.queue), free
+
+    def get_eta_cost(self, elevator: ElevatorData, source_floor: int):
+        elapsed, index, free = self.estimate_arrival(elevator, source_floor)
+        cost = elapsed
+        if elevator.max_capacity > 0:
+            cost += LOAD_PENALTY * elevator.actual_capacity / elevator.max_capacity
+        if free <= 0:
+            # arrives full, the passengers have to wait for another round
+            cost += elapsed + LOAD_PENALTY
+        return cost, index
+
+    def assign_calls_eta(self) -> List[ElevatorData]:
+        """
+        Assigns all outstanding hall calls in eta mode, each time the call and
+        elevator with the lowest cost over all of them, until the elevators
+        already stopping at each called floor can take its waiting passengers.
+
+        An assignment only changes the queue of one elevator, so the stops and
+        costs of the others are kept for the whole batch. The expected pickups
+        are counted once, and each assignment adds the capacity the elevator is
+        expected to have left at the floor; the capacity it then lacks at its
+        later stops is only counted again in the next batch. The costs are only
+        estimated for the floors with passengers left over.
+
+        :return: the elevators with new floors in their queue
+        """
+        called = self.get_called_floors()
+        stops = [self.get_stops(e) for e in self.elevators]
+        stop_sets = [set(s) for s in stops]
+        pickups = self.get_expected_pickups(stops)
+
+        # cost and queue index of each elevator by floor
+        costs: List[Dict[int, Tuple[float, int]]] = [{} for e in self.elevators]
+        assigned = {}
+        while True:
+            best = None
+            for f in called:
+                if f.waiting_count <= pickups[f.id]:
+                    continue
+                for e in self.elevators:
+                    if f.id in stop_sets[e.id]:
+                        # already on its way
+                        continue
+                    estimate = costs[e.id].get(f.id)
+                    if estimate is None:
+                        estimate = costs[e.id][f.id] = self.get_eta_cost(e, f.id)
+                    if best is None or estimate[0] < best[0]:
+                        best = (estimate[0], f.id, e, estimate[1])
+            if best is None:
+                break
+
+            _, f, elevator, index = best
+            _, _, free = self.estimate_arrival(elevator, f)
+            self.queue_insert(elevator, index, f)
+            assigned[elevator.id] = elevator
+
+            waiting = self.floors[f].waiting_count
+            pickups[f] += min(max(0, free), waiting - pickups[f])
+            stop_sets[elevator.id].add(f)
+            costs[elevator.id] = {}
+        return list(assigned.values())
+
+    def release_allocations(self, elevator: ElevatorData):
+        """Frees the allocations of the floors the elevator won't stop at anymore."""
+        for f in list(self.allocated_floors[elevator.id]):
+            if f == elevator.floor or f in elevator.queue:
+                continue
+            allocation = self.allocations[f]
+            for d in [d for d, e in allocation.items() if e == elevator.id]:
+                del allocation[d]
+            self.allocated_floors[elevator.id].discard(f)
+            self.changed_allocations.add(f)
+
+    def get_allocated_load(self, elevator: ElevatorData) -> int:
+        """:return: the number of waiting passengers allocated to the elevator"""
+        load = 0
+        for f in self.allocated_floors[elevator.id]:
+            destinations = self.floors[f].destinations
+            for d, e in self.allocations[f].items():
+                if e == elevator.id:
+                    load += destinations.get(d, 0)
+        return load
+
+    def get_destination_cost(
+        self, elevator: ElevatorData, source_floor: int, destination: int, count: int
+    ) -> Optional[Tuple[float, int]]:
+        """
+        Estimates the cost of sending the passengers of the source floor to the
+        destination floor with the elevator.
+
+        :return: the cost and the queue index to insert the source floor at, or
+            None if the elevator serves the other direction at the source floor
+        """
+        going_up = destination > source_floor
+        allocation = self.allocations[source_floor]
+        targets = set(elevator.queue)
+        for d, e in allocation.items():
+            if e != elevator.id:
+                continue
+            if (d > source_floor) != going_up:
+                # one stop only takes passengers in one direction
+                return None
+            targets.add(d)
+
+        elapsed, index, _ = self.estimate_arrival(elevator, source_floor)
+        cost = elapsed
+        if source_floor not in self.get_stops(elevator) and elevator.queue:
+            # delays the passengers already on their way
+            cost += STOP_TIME
+
+        # prefer elevators that already stop at or near the destination
+        if destination not in targets and targets:
+            nearest = min(abs(destination - t) for t in targets)
+            cost += STOP_TIME + nearest * FLOOR_TRAVEL_TIME
+
+        free = elevator.max_capacity - elevator.actual_capacity
+        if count > free - self.get_allocated_load(elevator):
+            # not everyone fits, the rest has to wait for another round
+            cost += elapsed + LOAD_PENALTY
+        return cost, index
+
+    def assign_destinations(self) -> List[ElevatorData]:
+        """
+        Allocates the waiting passengers without an elevator, grouped by their
+        source and destination floor, and queues the source floors.
+
+        :return: the elevators with new floors in their queue
+        """
+        assigned = {}
+        for f in sorted(self.demand_floors):
+            allocation = self.allocations[f]
+            demand = self.floors[f].destinations
+            for d, count in sorted(demand.items(), key=lambda i: -i[1]):
+                if d in allocation or d == f:
+                    continue
+
+                best = None
+                for e in self.elevators:
+                    estimate = self.get_destination_cost(e, f, d, count)
+                    if estimate is not None and (best is None or estimate[0] < best[0]):
+                        best = (estimate[0], e, estimate[1])
+                if best is None:
+                    continue
+
+                _, elevator, index = best
+                allocation[d] = elevator.id
+                self.allocated_floors[elevator.id].add(f)
+                self.changed_allocations.add(f)
+                if f not in self.get_stops(elevator):
+                    self.queue_insert(elevator, index, f)
+                    assigned[elevator.id] = elevator
+        return list(assigned.values())
+
+    def get_called_floor(self, called: List[FloorData]) -> Optional[int]:
+        """
+        :param called: the called floors to choose from, lowest first
+        :return: the floor to assign next by the scheduling mode
+        """
+        if self.mode == SMART:
+            return self.get_called_floor_smart(called)
+        elif self.mode == SMART_WITH_CAP:
+            return self.get_called_floor_smart_with_cap(called)
+        elif self.mode == DUMB:
+            return self.get_called_floor_dumb(called)
+        elif self.mode == SMARTER_DUMB:
+            return self.get_called_floor_smarter_dumb(called)
+        logging.error("unknown scheduling mode")
+        return None
+
+    def assign_calls(self) -> List[ElevatorData]:
+        """
+        Assigns all outstanding hall calls in one batch.
+
+        A floor whose assignment doesn't change any queue is skipped for the rest
+        of the batch, it can only be served differently after the state changed.
+        Every other assignment adds the floor to a queue that didn't have it, and
+        a queue is only dropped for a hall call if it has none, so the batch ends
+        and running it again without new input changes nothing.
+
+        :return: the elevators with new floors in their queue
+        """
+        if self.mode == DESTINATION:
+            return self.assign_destinations()
+        if self.mode == ETA:
+            return self.assign_calls_eta()
+
+        # assigning calls doesn't press or reset call buttons, so the called
+        # floors are the same for the whole batch
+        assigned = {}
+        called = self.get_called_floors()
+        while True:
+            source_floor = self.get_called_floor(called)
+            if source_floor is None:
+                break
+
+            elevator = self.assign_call(source_floor)
+            if elevator is None:
+                called = [f for f in called if f.id != source_floor]
+            else:
+                assigned[elevator.id] = elevator
+        return list(assigned.values())
+
+    def assign_call(self, source_floor: int) -> Optional[ElevatorData]:
+        """
+        Queues a called floor on the elevator selected by the scheduling mode.
+
+        :return: the selected elevator, or None if no queue was changed
+        """
+        elevator, drop_queue = self.select_elevator(source_floor)
+        # logging.debug(f"source_floor: {source_floor}; elevator: {elevator.id}")
+        assert isinstance(elevator, ElevatorData)
+        if (
+            (source_floor == elevator.floor)
+            or (elevator.actual_capacity >= elevator.max_capacity)
+            or (not drop_queue and source_floor in elevator.queue)
+        ):
+            return None
+
+        queue = [source_floor] if drop_queue else list(elevator.queue) + [source_floor]
+        if queue == list(elevator.queue):
+            # e.g. an empty elevator that only had the floor in its queue
+            return None
+        self.queue_replace(elevator, queue)
+        return elevator
+
+
+def compare_waiting_count(f):
+    return f["count"]
@@ -0,0 +1,121 @@
+# service.py
+
+import asyncio
+import logging
+import signal
+
+import paho.mqtt.client as mqtt
+from typing import Callable, Coroutine, List, Tuple
+from cps_common import clock
+
+
+async def sleep(seconds: float):
+    """Sleeps for a duration in simulation time."""
+    await asyncio.sleep(clock.to_wall(seconds))
+
+
+class Service:
+    """
+    Base of the services running on a single asyncio loop.
+
+    The MQTT client reads and writes its socket from the loop, so the message
+    handlers and the tasks of a service all run on the same thread and share
+    its state without locks. Each periodic concern of a service is one task
+    from tasks(); if one of them fails or the process is asked to stop, all
+    tasks are cancelled and the client disconnects before run() returns.
+
+    Services hosted by another service share its client and are not run
+    themselves; the host subscribes their topics and runs their tasks.
+    """
+
+    def __init__(self, client_id: str, client: mqtt.Client = None):
+        self.client = client if client is not None else mqtt.Client(client_id)
+        self._stopped = asyncio.Event()
+        self._disconnected = asyncio.Event()
+
+    def subscriptions(self) -> List[Tuple[str, Callable]]:
+        """:return: the (topic, handler) pairs subscribed on connect"""
+        return []
+
+    def tasks(self) -> List[Coroutine]:
+        """:return: the coroutines running as long as the service"""
+        return []
+
+    def on_connect(self, client, userdata, flags, rc):
+        logging.info("connected to broker!")
+
+        subscriptions = self.subscriptions()
+
+        # subscribe to multiple topics in a single SUBSCRIBE command
+        # QOS=1
+        self.client.subscribe([(s[0], 1) for s in subscriptions])
+        # add callback for each subscription
+        for s in subscriptions:
+            self.client.message_callback_add(s[0], s[1])
+        clock.subscribe(self.client)
+
+    def on_disconnect(self, client, userdata, rc):
+        logging.info("disconnected from broker")
+        self._disconnected.set()
+
+    def stop(self):
+        """Lets run() cancel the tasks, disconnect and return."""
+        self._stopped.set()
+
+    def run(self, host: str = "localhost", port: int = 1883):
+        asyncio.run(self.main(host, port))
+
+    async def main(self, host: str = "localhost", port: int = 1883):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.client.connect(host, port)
+
+        tasks = [asyncio.create_task(c) for c in [self._misc()] + self.tasks()]
+        stopped = asyncio.create_task(self._stopped.wait())
+        done, _ = await asyncio.wait(
+            tasks + [stopped], return_when=asyncio.FIRST_COMPLETED
+        )
+        for t in tasks + [stopped]:
+            t.cancel()
+        await asyncio.gather(*tasks, stopped, return_exceptions=True)
+        for t in done:
+            if t is not stopped and not t.cancelled() and t.exception():
+                logging.error("task failed", exc_info=t.exception())
+
+        # wait until the DISCONNECT was sent
+        self._disconnected.clear()
+        if self.client.disconnect() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.wait_for(self._disconnected.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _misc(self):
+        # keep-alive pings, retries and reconnects that loop_forever would do
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    self.client.reconnect()
+                except OSError as e:
+                    logging.error(f"reconnect failed: {e}")
+            await asyncio.sleep(1)
+
+    def _on_socket_open(self, client, userdata, sock):
+        asyncio.get_running_loop().add_reader(sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        asyncio.get_running_loop().remove_reader(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        asyncio.get_running_loop().add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        asyncio.get_running_loop().remove_writer(sock)
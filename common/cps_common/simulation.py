@@ -0,0 +1,296 @@
+# simulation.py
+
+import heapq
+import itertools
+import random
+
+from datetime import datetime
+from time import process_time_ns
+from typing import Callable, Iterable, Iterator, List
+from cps_common import clock
+from cps_common.data import Passenger, ElevatorData, ELEVATOR_COUNT, FLOOR_COUNT
+from cps_common.scheduling import (
+    Scheduler,
+    UP,
+    DOWN,
+    MULTIPLE_ELEVATOR_THRESHOLD,
+    MAX_ELEVATOR_PER_FLOOR,
+)
+from cps_common.car import Car
+from cps_common.hall import Hall
+
+
+# timing of the services in seconds, same as the sleeps of the MQTT deployment
+# Elevator.move: time to travel one floor
+TRAVEL_TIME = 3
+# Floor.push_call_button_wrapper, the elevators publish their state on change
+HEARTBEAT_PERIOD = 1
+
+
+class Simulation:
+    """
+    Discrete-event simulation of the whole building in a single process.
+
+    The controller scheduling, elevator movement and floor boarding logic is
+    called directly instead of through MQTT topics, and the periodic loops of the
+    services are events on a virtual clock instead of sleeping threads.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        seed: int = None,
+        epoch: datetime = None,
+        elevator_count: int = ELEVATOR_COUNT,
+        floor_count: int = FLOOR_COUNT,
+        multiple_elevator_threshold: int = MULTIPLE_ELEVATOR_THRESHOLD,
+        max_elevator_per_floor: int = MAX_ELEVATOR_PER_FLOOR,
+    ):
+        self.now: float = 0
+        self.epoch = epoch if epoch is not None else datetime.now()
+        self._epoch_ns = clock.datetime_to_ns(self.epoch)
+        self._events = []
+        self._seq = itertools.count()
+
+        self.scheduler = Scheduler(
+            mode,
+            elevator_count=elevator_count,
+            floor_count=floor_count,
+            multiple_elevator_threshold=multiple_elevator_threshold,
+            max_elevator_per_floor=max_elevator_per_floor,
+        )
+        self.cars: List[Car] = [Car(e.id) for e in self.scheduler.elevators]
+
+        # all floors see the same elevator messages, so they share one copy
+        rng = random.Random(seed)
+        self.elevators: List[ElevatorData] = [ElevatorData(c.id) for c in self.cars]
+        self.halls: List[Hall] = [
+            Hall(f.id, elevator_count=0, rng=rng) for f in self.scheduler.floors
+        ]
+        for h in self.halls:
+            h.elevators = self.elevators
+
+        self.expected = 0
+        # streams of passengers that have more entries to come
+        self._streams = 0
+        self.records: List[Passenger] = []
+
+        # scheduling batches, each like one run of the controller's scheduler
+        # task, and the CPU time spent in them
+        self.decisions = 0
+        self.decision_ns = 0
+
+        self._scheduling = False
+        self._moving = [False for c in self.cars]
+        self._pushing = [False for h in self.halls]
+
+        for c in self.cars:
+            self.schedule(0, self._publish_state, c.id)
+
+    def schedule(self, delay: float, callback: Callable, *args):
+        event = (self.now + delay, next(self._seq), callback, args)
+        heapq.heappush(self._events, event)
+
+    def timestamp(self) -> int:
+        """:return: the simulation time as nanoseconds since clock.EPOCH"""
+        return self._epoch_ns + round(self.now * 1e6) * 1000
+
+    def add_passengers(self, time: float, floor: int, passengers: List[dict]):
+        """
+        Schedules passengers to arrive at a floor.
+
+        :param time: simulation time of the arrival in seconds
+        :param floor: start floor of the passengers
+        :param passengers: list of dicts with "id" and "destination"
+        """
+        self.expected += len(passengers)
+        heapq.heappush(
+            self._events,
+            (time, next(self._seq), self._on_passenger_waiting, (floor, passengers)),
+        )
+
+    def add_scenario(self, entries: list):
+        """Schedules the (time, start floor, passengers) entries of a scenario."""
+        for time, floor, passengers in entries:
+            self.add_passengers(time, floor, passengers)
+
+    def add_stream(self, entries: Iterable):
+        """
+        Schedules the (time, start floor, passengers) entries of a scenario that
+        are in time order, e.g. generated traffic, taking the next entry only
+        once the previous one arrived.
+        """
+        self._streams += 1
+        self._next_entry(iter(entries))
+
+    def _next_entry(self, entries: Iterator):
+        entry = next(entries, None)
+        if entry is None:
+            self._streams -= 1
+            return
+        time, floor, passengers = entry
+        self.add_passengers(time, floor, passengers)
+        # after the arrival of these passengers, as it was pushed before
+        heapq.heappush(
+            self._events, (time, next(self._seq), self._next_entry, (entries,))
+        )
+
+    def run(self, until: float = None) -> List[Passenger]:
+        """
+        Runs the simulation until all passengers arrived.
+
+        :param until: stop at this simulation time in seconds even if not all
+            passengers arrived
+        :return: the arrived passengers, as the recorder would write them
+        """
+        while self._events and (self._streams or len(self.records) < self.expected):
+            if until is not None and self._events[0][0] > until:
+                self.now = until
+                break
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+        return self.records
+
+    # floor
+
+    def _on_passenger_waiting(self, floor: int, passengers: List[dict]):
+        timestamp = self.timestamp()
+        hall = self.halls[floor]
+        hall.add_waiting(
+            [
+                Passenger(
+                    id=p["id"],
+                    start_floor=floor,
+                    end_floor=p["destination"],
+                    start_timestamp=timestamp,
+                )
+                for p in passengers
+            ]
+        )
+        if self.scheduler.set_floor_waiting_count(floor, hall.waiting_count):
+            self._wake_scheduler()
+        self._push_call_button(floor)
+        self._board_waiting(floor)
+
+        if not self._pushing[floor]:
+            self._pushing[floor] = True
+            self.schedule(HEARTBEAT_PERIOD, self._call_button_tick, floor)
+
+    def _call_button_tick(self, floor: int):
+        if self.halls[floor].waiting_count == 0:
+            self._pushing[floor] = False
+            return
+        self._push_call_button(floor)
+        self.schedule(HEARTBEAT_PERIOD, self._call_button_tick, floor)
+
+    def _push_call_button(self, floor: int):
+        hall = self.halls[floor]
+        up, down = hall.call_buttons()
+        # floor/{id}/destinations
+        changed = self.scheduler.set_floor_destinations(
+            floor, hall.destination_demand()
+        )
+        if up:
+            changed |= self.scheduler.set_floor_button(floor, UP, up)
+        if down:
+            changed |= self.scheduler.set_floor_button(floor, DOWN, down)
+        if changed:
+            self._wake_scheduler()
+
+    def _on_passenger_arrived(self, floor: int, passengers: List[Passenger]):
+        self.halls[floor].arrive(passengers, self.timestamp())
+        self.records += passengers
+
+    # controller
+
+    def _wake_scheduler(self):
+        # state changes at the same time are handled by a single batch
+        if not self._scheduling:
+            self._scheduling = True
+            self.schedule(0, self._scheduler_batch)
+
+    def _scheduler_batch(self):
+        self._scheduling = False
+        started = process_time_ns()
+        assigned = self.scheduler.assign_calls()
+        self.decision_ns += process_time_ns() - started
+        self.decisions += 1
+        for elevator in assigned:
+            self._dispatch(elevator.id)
+
+        # floor/{id}/allocation
+        changed_allocations = sorted(self.scheduler.changed_allocations)
+        self.scheduler.changed_allocations.clear()
+        for f in changed_allocations:
+            self.halls[f].allocation = dict(self.scheduler.allocations[f])
+            self._board_waiting(f)
+
+    def _dispatch(self, id: int):
+        # elevator/{id}/next_floor, sent whenever the queue head changed
+        queue = self.scheduler.elevators[id].queue
+        if queue and self.cars[id].set_next_floor(int(queue[0])):
+            self._wake_car(id)
+
+    # elevator
+
+    def _wake_car(self, id: int):
+        car = self.cars[id]
+        if not self._moving[id] and car.currentFloor != car.nextFloor:
+            self._moving[id] = True
+            self.schedule(TRAVEL_TIME, self._move_tick, id)
+
+    def _move_tick(self, id: int):
+        car = self.cars[id]
+        leaving = car.step(self.timestamp())
+        if leaving is not None:
+            self._on_passenger_arrived(car.currentFloor, leaving)
+        self._publish_state(id)
+
+        if car.currentFloor != car.nextFloor:
+            self.schedule(TRAVEL_TIME, self._move_tick, id)
+        else:
+            self._moving[id] = False
+
+    def _publish_state(self, id: int):
+        # elevator/{id}/state, sent by the elevator whenever its state changed
+        car = self.cars[id]
+        elevator = self.elevators[id]
+        elevator.actual_capacity = car.actualCap
+        elevator.max_capacity = car.maxCap
+        elevator.floor = car.currentFloor
+        elevator.door = car.door_status
+
+        changed = self.scheduler.set_elevator_capacity(id, car.actualCap, car.maxCap)
+        if self.scheduler.set_elevator_floor(id, car.currentFloor):
+            self._dispatch(id)
+            changed = True
+        changed |= self.scheduler.set_elevator_door(id, car.door_status)
+        if changed:
+            self._wake_scheduler()
+
+        self._board(id, car.currentFloor)
+
+    def _board_waiting(self, floor: int):
+        for e in self.elevators:
+            if e.floor == floor and e.door == "open":
+                self._board(e.id, floor)
+
+    def _board(self, id: int, floor: int):
+        hall = self.halls[floor]
+        enter_list = hall.board(id, self.elevators[id].door)
+        if enter_list is None:
+            return
+
+        car = self.cars[id]
+        selected = car.board(enter_list, self.timestamp())
+        # the scheduler has to see the new load before it runs, or it takes the
+        # car for empty and clears its queue with the passengers still inside
+        self.elevators[id].actual_capacity = car.actualCap
+        self.scheduler.set_elevator_capacity(id, car.actualCap, car.maxCap)
+        self.scheduler.set_floor_waiting_count(floor, hall.waiting_count)
+        self.scheduler.add_selected_floors(id, list(selected))
+        self._dispatch(id)
+        self._push_call_button(floor)
+        self._wake_scheduler()
+        if enter_list:
+            self.schedule(0, self._publish_state, id)
@@ -0,0 +1,74 @@
+# sketch.py
+
+import math
+
+from typing import Dict, Optional
+
+# relative error of the quantiles
+ACCURACY = 0.01
+# smaller values are counted as zero
+MIN_VALUE = 1e-3
+
+
+class QuantileSketch:
+    """
+    Streaming quantiles of non-negative values in bounded memory.
+
+    Values are counted in buckets whose bounds grow by a constant factor, as in
+    DDSketch or HDR histograms. Every quantile is within `accuracy` of the true
+    value, and the number of buckets only grows with the logarithm of the range
+    of values, e.g. less than 1000 buckets for 1 ms to one day at 1 %.
+    """
+
+    def __init__(self, accuracy: float = ACCURACY, min_value: float = MIN_VALUE):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value < self.min_value:
+            self.zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other: "QuantileSketch"):
+        """Adds the values of a sketch with the same accuracy."""
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """:param q: quantile in [0, 1]"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return self.min
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # the value with the same relative error to both bucket bounds
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
@@ -0,0 +1,113 @@
+# timeline.py
+
+import os
+import json
+import logging
+import hashlib
+import tempfile
+import numpy as np
+
+from typing import Iterator, List, Tuple
+
+TIMELINE_VERSION = 1
+# one row per passenger, sorted by time, ids in the order of the definition
+TIMELINE_DTYPE = np.dtype(
+    [("time", "<f8"), ("start", "<i4"), ("destination", "<i4"), ("id", "<i8")]
+)
+# compiled scenarios by content hash
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "elevator-sim")
+# rows converted to passengers at once by timeline_entries
+CHUNK_SIZE = 1 << 16
+
+
+def read_definition(path: str) -> list:
+    """Loads a YAML or JSON scenario definition."""
+    with open(path, "r") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        import yaml
+
+        # the C parser if PyYAML was built with libyaml
+        loader = getattr(yaml, "CBaseLoader", yaml.BaseLoader)
+        return yaml.load(f.read(), Loader=loader)
+
+
+def compile_scenario(samples: list) -> np.ndarray:
+    """
+    Compiles a scenario definition into its event timeline.
+
+    :param samples: the loaded scenario definition, a list of samples with a
+        `time` and the `passengers` by `start` floor and `destinations`
+    :return: array of TIMELINE_DTYPE with one row per passenger, numbered in
+        the order of the definition and stably sorted by time
+    """
+    times, starts, destinations, counts = [], [], [], []
+    for s in samples:
+        for p in s["passengers"]:
+            for destination, count in p["destinations"].items():
+                times.append(int(s["time"]))
+                starts.append(int(p["start"]))
+                destinations.append(int(destination))
+                counts.append(int(count))
+
+    counts = np.array(counts, dtype=np.int64)
+    timeline = np.empty(counts.sum(), dtype=TIMELINE_DTYPE)
+    timeline["time"] = np.repeat(np.array(times, dtype=np.float64), counts)
+    timeline["start"] = np.repeat(np.array(starts, dtype=np.int32), counts)
+    timeline["destination"] = np.repeat(
+        np.array(destinations, dtype=np.int32), counts
+    )
+    timeline["id"] = np.arange(len(timeline))
+    return timeline[np.argsort(timeline["time"], kind="stable")]
+
+
+def cache_path(path: str, cache_dir: str = CACHE_DIR) -> str:
+    """:return: the file of the compiled scenario, named by the hash of its content"""
+    digest = hashlib.sha256(f"timeline{TIMELINE_VERSION}\n".encode("utf-8"))
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    return os.path.join(cache_dir, digest.hexdigest() + ".npy")
+
+
+def load_timeline(path: str, cache_dir: str = CACHE_DIR) -> np.ndarray:
+    """
+    Loads the timeline of a scenario file, compiling it on the first use.
+
+    :return: the timeline memory-mapped from the cache, or in memory if it
+        cannot be cached
+    """
+    compiled = cache_path(path, cache_dir)
+    if os.path.exists(compiled):
+        return np.load(compiled, mmap_mode="r")
+
+    timeline = compile_scenario(read_definition(path))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # concurrent runs compiling the same scenario each replace it whole
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, timeline, allow_pickle=False)
+        os.replace(tmp, compiled)
+    except OSError as e:
+        logging.warning(f"cannot cache the timeline of {path}: {e}")
+        return timeline
+    return np.load(compiled, mmap_mode="r")
+
+
+def timeline_entries(timeline: np.ndarray) -> Iterator[Tuple[float, int, List[dict]]]:
+    """
+    :return: iterator of (time, start floor, passengers) entries, one for the
+        passengers with the same time and start floor, in time order; each
+        passenger is a dict with "id", "start" and "destination"
+    """
+    key, passengers = None, []
+    for begin in range(0, len(timeline), CHUNK_SIZE):
+        rows = timeline[begin : begin + CHUNK_SIZE].tolist()
+        for time, start, destination, id in rows:
+            if (time, start) != key:
+                if passengers:
+                    yield key[0], key[1], passengers
+                key, passengers = (time, start), []
+            passengers.append({"id": id, "start": start, "destination": destination})
+    if passengers:
+        yield key[0], key[1], passengers
@@ -0,0 +1,128 @@
+# traffic.py
+
+import heapq
+import random
+import bisect
+import itertools
+
+from typing import Iterator, List, Tuple
+from cps_common.data import FLOOR_COUNT
+
+# traffic patterns of a profile phase
+# arrivals at every floor with the same or a per floor rate, to any other floor
+POISSON = "poisson"
+# mostly from the lobby to the other floors
+UP_PEAK = "up_peak"
+# mostly from the other floors to the lobby
+DOWN_PEAK = "down_peak"
+# mostly between the lobby and the other floors in both directions
+LUNCH = "lunch"
+# explicit rates from each floor to each floor
+OD = "od"
+
+# share of the peak traffic of a phase, the rest is between random floors
+PEAK_SHARE = 0.9
+
+Entry = Tuple[float, int, List[dict]]
+
+
+def rate_matrix(phase: dict, floor_count: int, lobby: int = 0) -> List[List[float]]:
+    """
+    :param phase: pattern and rate of a profile phase
+    :return: arrival rate in passengers per second from each start floor (row)
+        to each destination floor (column)
+    """
+    pattern = phase["pattern"]
+    if pattern == OD:
+        matrix = [[float(r) for r in row] for row in phase["matrix"]]
+        if len(matrix) != floor_count or any(len(r) != floor_count for r in matrix):
+            raise ValueError(f"O-D matrix has to be {floor_count}x{floor_count}")
+        return matrix
+
+    matrix = [[0.0] * floor_count for _ in range(floor_count)]
+    others = [f for f in range(floor_count) if f != lobby]
+
+    def spread(start_floors, destinations, rate):
+        pairs = [(s, d) for s in start_floors for d in destinations if s != d]
+        for s, d in pairs:
+            matrix[s][d] += rate / len(pairs)
+
+    if pattern == POISSON:
+        rates = phase["rate"]
+        if not isinstance(rates, list):
+            rates = [rates] * floor_count
+        for s in range(floor_count):
+            spread([s], range(floor_count), float(rates[s]))
+        return matrix
+
+    rate = float(phase["rate"])
+    share = float(phase.get("share", PEAK_SHARE))
+    if pattern == UP_PEAK:
+        spread([lobby], others, rate * share)
+    elif pattern == DOWN_PEAK:
+        spread(others, [lobby], rate * share)
+    elif pattern == LUNCH:
+        spread([lobby], others, rate * share / 2)
+        spread(others, [lobby], rate * share / 2)
+    else:
+        raise ValueError(f"unknown traffic pattern {pattern}")
+    spread(range(floor_count), range(floor_count), rate * (1 - share))
+    return matrix
+
+
+def _arrivals(
+    matrix: List[List[float]], start: float, end: float, rng: random.Random
+) -> Iterator[Tuple[float, int, int]]:
+    # a poisson process with the total rate, each arrival picks its start and
+    # destination floor with the probability of their rate
+    pairs = [
+        (s, d) for s, row in enumerate(matrix) for d, rate in enumerate(row) if rate
+    ]
+    weights = list(itertools.accumulate(matrix[s][d] for s, d in pairs))
+    if not pairs:
+        return
+    total = weights[-1]
+
+    time = start
+    while True:
+        time += rng.expovariate(total)
+        if time >= end:
+            return
+        s, d = pairs[bisect.bisect_right(weights, rng.random() * total)]
+        yield time, s, d
+
+
+def generate_traffic(profile: dict, seed: int = None) -> Iterator[Entry]:
+    """
+    Generates the passengers of a traffic profile lazily in time order.
+
+    The profile has the number of `floors`, the `lobby` floor and a list of
+    `phases`, each with a `pattern`, `start` and `end` time in seconds and the
+    `rate` of passengers per second (a `matrix` of rates for OD). Overlapping
+    phases add up.
+
+    :param seed: the same seed generates the same passengers
+    :return: iterator of (time, start floor, passengers) entries like
+        timeline.timeline_entries, with one passenger each
+    """
+    floor_count = int(profile.get("floors", FLOOR_COUNT))
+    lobby = int(profile.get("lobby", 0))
+
+    streams = []
+    for i, phase in enumerate(profile["phases"]):
+        matrix = rate_matrix(phase, floor_count, lobby)
+        # every phase has its own generator, so phases don't change each other
+        rng = random.Random(None if seed is None else f"{seed}:{i}")
+        start, end = float(phase.get("start", 0)), float(phase["end"])
+        streams.append(_arrivals(matrix, start, end, rng))
+
+    for id, (time, start, destination) in enumerate(heapq.merge(*streams)):
+        yield time, start, [{"id": id, "start": start, "destination": destination}]
+
+
+def load_profile(path: str) -> dict:
+    """Loads a traffic profile from a YAML file."""
+    import yaml
+
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
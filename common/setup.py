@@ -8,5 +8,5 @@ setuptools.setup(
     author="pokgak",
     description="CPS common definitions",
     packages=setuptools.find_packages(),
-    python_requires='>=3.7',
+    python_requires='>=3.10',
 )
\ No newline at end of file
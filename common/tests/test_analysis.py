@@ -0,0 +1,31 @@
+# test_analysis.py
+
+import numpy as np
+
+from cps_common.analysis import load_csv, durations, stats
+from cps_common.data import RECORD_FIELDS
+from cps_common.results import RESULT_COLUMNS
+
+
+def test_load_csv_without_passengers(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(",".join(RECORD_FIELDS) + "\n")
+
+    columns = load_csv(str(path))
+    assert sorted(columns) == sorted(RESULT_COLUMNS)
+    for values in columns.values():
+        assert values.dtype == np.int64 and len(values) == 0
+    assert stats(durations(columns)["wait"])["count"] == 0
+
+
+def test_load_csv(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(
+        ",".join(RECORD_FIELDS)
+        + "\n3,0,2,2020-01-01T00:00:00,2020-01-01T00:00:01.5,,\n"
+    )
+
+    columns = load_csv(str(path))
+    assert columns["id"].tolist() == [3]
+    assert durations(columns)["wait"].tolist() == [1.5]
+    assert np.isnan(durations(columns)["ride"][0])
@@ -0,0 +1,58 @@
+# test_data.py
+
+import struct
+import pytest
+
+from cps_common import clock
+from cps_common.data import (
+    Passenger,
+    JSON,
+    BINARY,
+    encode_passengers,
+    decode_passengers,
+)
+
+
+def passengers(start_ns: int):
+    return [
+        Passenger(
+            id=0,
+            start_floor=0,
+            end_floor=9,
+            start_timestamp=start_ns,
+            enter_elevator=start_ns + 3_000_000,
+            leave_elevator=start_ns + 30_000_000,
+            end_timestamp=start_ns + 30_000_000,
+        ),
+        # still waiting, without the later timestamps
+        Passenger(id=2 ** 40, start_floor=7, end_floor=1, start_timestamp=start_ns),
+    ]
+
+
+@pytest.mark.parametrize("codec", [JSON, BINARY])
+def test_round_trip(codec):
+    # the clock has microsecond resolution
+    sent = passengers(clock.now_ns())
+    received = decode_passengers(encode_passengers(sent, codec=codec))
+    assert received == sent
+    assert received[1].enter_elevator_ns is None
+    assert received[1].end_ns is None
+
+
+def test_binary_keeps_nanoseconds():
+    sent = passengers(1_234_567_891)
+    assert decode_passengers(encode_passengers(sent, codec=BINARY)) == sent
+
+
+def test_binary_unknown_version():
+    no_timestamp = -(2 ** 63)
+    payload = struct.pack("<2sBI", b"PB", 1, 1) + struct.pack(
+        "<q2i4q", 5, 1, 2, 1_234_567, 1_234_568, no_timestamp, no_timestamp
+    )
+    with pytest.raises(ValueError):
+        decode_passengers(payload)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        encode_passengers([], codec="xml")
@@ -0,0 +1,46 @@
+# test_scheduling.py
+
+import pytest
+
+from cps_common.scheduling import (
+    Scheduler,
+    SMART,
+    DUMB,
+    SMARTER_DUMB,
+    SMART_WITH_CAP,
+    ETA,
+    UP,
+    DOWN,
+)
+
+
+def busy_building(mode: str) -> Scheduler:
+    # more called floors than empty elevators, all of them at the lobby
+    scheduler = Scheduler(mode, elevator_count=2, floor_count=10)
+    for e in scheduler.elevators:
+        scheduler.set_elevator_capacity(e.id, 0, 20)
+        scheduler.set_elevator_door(e.id, "closed")
+    for f, count in [(2, 3), (5, 12), (9, 1)]:
+        scheduler.set_floor_waiting_count(f, count)
+        scheduler.set_floor_button(f, DOWN, True)
+    scheduler.set_floor_waiting_count(3, 4)
+    scheduler.set_floor_button(3, UP, True)
+    return scheduler
+
+
+@pytest.mark.parametrize("mode", [SMART, DUMB, SMARTER_DUMB, SMART_WITH_CAP, ETA])
+def test_assign_calls_without_changes(mode):
+    scheduler = busy_building(mode)
+    assert scheduler.assign_calls()
+    queues = [list(e.queue) for e in scheduler.elevators]
+
+    assert scheduler.assign_calls() == []
+    assert [list(e.queue) for e in scheduler.elevators] == queues
+
+
+@pytest.mark.parametrize("mode", [SMART, DUMB, SMARTER_DUMB, SMART_WITH_CAP, ETA])
+def test_assign_calls_serves_every_floor(mode):
+    scheduler = busy_building(mode)
+    scheduler.assign_calls()
+    queued = {f for e in scheduler.elevators for f in e.queue}
+    assert queued == {2, 3, 5, 9}
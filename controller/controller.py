@@ -3,116 +3,108 @@
 import os
 import logging
 import argparse
-import threading
+import asyncio
 import json
-import time
 
-import paho.mqtt.client as mqtt
-from typing import List, Deque
+from typing import List, Optional, Set
 from collections import deque
-from cps_common.data import ElevatorData, FloorData
-
-
-# mode
-SMART = "smart"
-DUMB = "dumb"
-SMARTER_DUMB = "smarter_dumb"
-SMART_WITH_CAP = "smart_with_cap"
-
-# in smart mode, the waiting count threshold to send multiple (>1) elevator to the floor
-MULTIPLE_ELEVATOR_THRESHOLD = 10
-# in smarter dumb mode, configure how many elevator can be sent per floor
-MAX_ELEVATOR_PER_FLOOR = 3
-
-# direction
-UP = "up"
-DOWN = "down"
-
-
-class Controller:
-    def __init__(self, mode: str):
-        self.mode = mode
-        self.elevators: List[ElevatorData] = [ElevatorData(id) for id in range(0, 6)]
-        self.floors: List[FloorData] = [FloorData(id) for id in range(0, 10)]
-        self._callButtonEvent = threading.Event()
-
-    def run(self, host: str = "localhost", port: int = 1883):
-        # setup MQTT
-        self.client = mqtt.Client("controller")
-        self.client.on_connect = self.on_connect
-        self.client.on_disconnect = self.on_disconnect
-        self.client.connect(host, port)
-
-        self.schedulerThread = threading.Thread(target=self.scheduler)
-        self.schedulerThread.start()
-
-        self.dispatcher_locks: List[threading.Condition] = []
-        self.dispatcher_threads: List[threading.Thread] = []
-        for id in range(0, 6):
-            self.dispatcher_locks.append(
-                threading.Condition()
-            )  # lock for each elevator
-            self.dispatcher_threads.append(
-                threading.Thread(target=self.elevator_dispatcher, kwargs={"id": id})
-            )
-            self.dispatcher_threads[id].start()
-
-        self.client.loop_forever()
+from cps_common import clock
+from cps_common.data import ELEVATOR_COUNT, FLOOR_COUNT, decode_elevator_state
+from cps_common.scheduling import Scheduler
+from cps_common.service import Service
+
+
+class Controller(Scheduler, Service):
+    def __init__(
+        self,
+        mode: str,
+        elevator_count: int = ELEVATOR_COUNT,
+        floor_count: int = FLOOR_COUNT,
+    ):
+        Scheduler.__init__(
+            self, mode, elevator_count=elevator_count, floor_count=floor_count
+        )
+        Service.__init__(self, "controller")
+        # set by hall calls and elevator state changes waiting to be scheduled
+        self._work = asyncio.Event()
+        # elevators whose queue might have changed since it was last published
+        self._dispatch: Set[int] = set()
+        self._dispatching = asyncio.Event()
+        # queue payload and next floor last published for each elevator
+        self._published_queues: List[Optional[str]] = [None for e in self.elevators]
+        self._published_next_floors: List[Optional[int]] = [
+            None for e in self.elevators
+        ]
 
-    def on_connect(self, client, userdata, flags, rc):
-        logging.info("connected to broker!")
+    def tasks(self):
+        return [self.scheduler(), self.dispatcher()]
 
-        subscriptions = [
+    def subscriptions(self):
+        return [
+            ("elevator/+/state", self.on_elevator_state),
             ("elevator/+/status", self.on_elevator_status),
             ("elevator/+/actual_floor", self.on_elevator_actual_floor),
             ("elevator/+/capacity", self.on_elevator_capacity),
+            ("elevator/+/door", self.on_elevator_door),
             ("elevator/+/selected_floors", self.on_elevator_selected_floors),
             ("floor/+/waiting_count", self.on_floor_waiting_count),
+            ("floor/+/destinations", self.on_floor_destinations),
             ("floor/+/button_pressed/#", self.on_floor_button_pressed),
         ]
 
-        # subscribe to multiple topics in a single SUBSCRIBE command
-        # QOS=1
-        self.client.subscribe([(s[0], 1) for s in subscriptions])
-        # add callback for each subscription
-        for s in subscriptions:
-            self.client.message_callback_add(s[0], s[1])
+    def on_connect(self, client, userdata, flags, rc):
+        super().on_connect(client, userdata, flags, rc)
+        # lets the recorded passengers be attributed to the scheduling mode
+        self.client.publish("controller/mode", self.mode, qos=1, retain=True)
+        # replaces the retained next floors of an earlier run or connection
+        for e in self.elevators:
+            self.publish_next_floor(e.id)
+
+    def queue_dispatch(self, id: int):
+        self._dispatch.add(id)
+        self._dispatching.set()
 
-    def on_disconnect(self, client, userdata, rc):
-        logging.info("disconnected from broker")
+    def on_elevator_state(self, client, userdata, msg):
+        id = int(msg.topic.split("/")[1])
+        try:
+            state = decode_elevator_state(msg.payload)
+        except ValueError:
+            logging.error(f"unsupported message on {msg.topic}")
+            return
+
+        changed = False
+        floor_changed = False
+        if "status" in state:
+            self.set_elevator_status(id, state["status"])
+        if "actual" in state and "max" in state:
+            changed |= self.set_elevator_capacity(id, state["actual"], state["max"])
+        if "floor" in state:
+            floor_changed = self.set_elevator_floor(id, state["floor"])
+        if "door" in state:
+            changed |= self.set_elevator_door(id, state["door"])
+
+        if floor_changed:
+            # the queue head is removed when the elevator arrived
+            self.queue_dispatch(id)
+        if changed or floor_changed:
+            self._work.set()
 
     def on_elevator_status(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
 
         id = int(msg.topic.split("/")[1])
-        elevator = self.elevators[id]
-        elevator.status = msg.payload.decode("utf-8")
-        # logging.debug(f"elevator {id} status {elevator.status}")
+        self.set_elevator_status(id, msg.payload.decode("utf-8"))
+        # logging.debug(f"elevator {id} status {self.elevators[id].status}")
 
     def on_elevator_actual_floor(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
 
         id = int(msg.topic.split("/")[1])
-        elevator = self.elevators[id]
-        elevator.floor = int(msg.payload)
-        # logging.debug(f"elevator {id} actual floor {elevator.floor}")
-        if elevator.old_floor != elevator.floor:
-            elevator.old_floor = elevator.floor
-
-        if elevator.floor > elevator.old_floor:
-            elevator.direction = UP
-        elif elevator.floor < elevator.old_floor:
-            elevator.direction = DOWN
-
-        if elevator.queue and elevator.floor == elevator.queue[0]:
-            # resets call button when an elevator is driving in that direction
-            floor = self.floors[elevator.floor]
-            if elevator.direction == UP:
-                floor.up_pressed = False
-            elif elevator.direction == DOWN:
-                floor.down_pressed = False
-
-            elevator.queue.popleft()
+        if self.set_elevator_floor(id, int(msg.payload)):
+            # the queue head is removed when the elevator arrived
+            self.queue_dispatch(id)
+            self._work.set()
+        # logging.debug(f"elevator {id} actual floor {self.elevators[id].floor}")
 
     def on_elevator_capacity(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
@@ -120,275 +112,107 @@ class Controller:
         id = int(msg.topic.split("/")[1])
         capacity = json.loads(msg.payload)
 
-        elevator = self.elevators[id]
-        elevator.actual_capacity = capacity["actual"]
-        elevator.max_capacity = capacity["max"]
-        # logging.debug(f"elevator {id} actual cap {elevator.actual_capacity}")
-        # logging.debug(f"elevator {id} max cap {elevator.max_capacity}")
+        if self.set_elevator_capacity(id, capacity["actual"], capacity["max"]):
+            self._work.set()
+        # logging.debug(f"elevator {id} capacity {capacity}")
+
+    def on_elevator_door(self, client, userdata, msg):
+        id = int(msg.topic.split("/")[1])
+        if self.set_elevator_door(id, msg.payload.decode("utf-8")):
+            self._work.set()
 
     def on_floor_waiting_count(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
 
         id = int(msg.topic.split("/")[1])
-        floor = self.floors[id]
-        floor.waiting_count = int(msg.payload)
-        # logging.debug(f"floor {id} waiting count {floor.waiting_count}")
+        if self.set_floor_waiting_count(id, int(msg.payload)):
+            self._work.set()
+        # logging.debug(f"floor {id} waiting count {self.floors[id].waiting_count}")
+
+    def on_floor_destinations(self, client, userdata, msg):
+        id = int(msg.topic.split("/")[1])
+        if self.set_floor_destinations(id, json.loads(msg.payload)):
+            self._work.set()
 
     def on_floor_button_pressed(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
 
         id = int(msg.topic.split("/")[1])
-        floor = self.floors[id]
         # get last section of the topic: "up" or "down"
         direction = msg.topic.split("/")[-1]
         value = bool(msg.payload)
         # logging.debug(f"floor {id} button direction: {direction}; value: {value}")
 
-        if direction == "up":
-            floor.up_pressed = value
-        elif direction == "down":
-            floor.down_pressed = value
-        else:
-            logging.warning("unknown button direction received")
-
-        self._callButtonEvent.set()
+        if self.set_floor_button(id, direction, value):
+            self._work.set()
 
     def on_elevator_selected_floors(self, client, userdata, msg):
         id = int(msg.topic.split("/")[1])
-        elevator = self.elevators[id]
 
         selected = json.loads(msg.payload)
         # logging.debug(f"elevator {id} selected floors: {selected}")
-        if elevator.actual_capacity < elevator.max_capacity:
-            elevator.queue += [f for f in selected if f not in elevator.queue]
-        else:
-            logging.debug(
-                f"clearing elevator {elevator.id} queue; added {selected} to queue"
-            )
-            # ignore calling floor, send passenger in elevator first
-            elevator.queue = deque(selected)
-
-        elevator.queue = self.sort_queue(
-            elevator.direction, elevator.floor, elevator.queue
-        )
-        # logging.debug(f"sorted queue: {elevator.queue}")
-
+        self.add_selected_floors(id, selected)
+        # logging.debug(f"sorted queue: {self.elevators[id].queue}")
+
+        self.queue_dispatch(id)
+        self._work.set()
+
+    async def scheduler(self):
+        logging.debug(f"Start Scheduling Task")
+        while True:
+            # sleep until some state changed, then handle everything pending
+            await self._work.wait()
+            self._work.clear()
+
+            for elevator in self.assign_calls():
+                self.queue_dispatch(elevator.id)
+
+            for f in sorted(self.changed_allocations):
+                self.client.publish(
+                    f"floor/{f}/allocation", json.dumps(self.allocations[f]), qos=1
+                )
+            self.changed_allocations.clear()
+
+    async def dispatcher(self):
+        logging.debug(f"Start Dispatcher Task")
+        while True:
+            # sleep until a queue changed, then publish all changed elevators
+            await self._dispatching.wait()
+            self._dispatching.clear()
+
+            ids = sorted(self._dispatch)
+            self._dispatch.clear()
+            for id in ids:
+                self.dispatch(id)
+
+    def dispatch(self, id: int):
+        """Publishes the queue and next floor of the elevator if they changed."""
+        elevator = self.elevators[id]
+        payload = json.dumps(elevator.queue, cls=DequeEncoder)
+        if payload != self._published_queues[id]:
+            self.client.publish(f"simulation/elevator/{id}/queue", payload, qos=0)
+            self._published_queues[id] = payload
+
+        next_floor = int(elevator.queue[0]) if elevator.queue else None
+        if next_floor != self._published_next_floors[id]:
+            self.publish_next_floor(id)
+
+    def publish_next_floor(self, id: int):
+        """
+        Publishes the head of the elevator queue as retained message, so an
+        elevator that restarts or reconnects gets it again. An empty queue
+        clears the retained message.
+        """
+        elevator = self.elevators[id]
+        next_floor = int(elevator.queue[0]) if elevator.queue else None
+        # logging.debug(f"elevator {id} next_floor: {next_floor}")
         self.client.publish(
-            f"simulation/elevator/{elevator.id}/queue",
-            json.dumps(elevator.queue, cls=DequeEncoder),
-            qos=0,
+            f"elevator/{id}/next_floor",
+            "" if next_floor is None else next_floor,
+            qos=1,
+            retain=True,
         )
-
-        cv = self.dispatcher_locks[id]
-        with cv:
-            cv.notify()
-
-    def sort_queue(
-        self, direction: str, current_floor: int, q: Deque[int]
-    ) -> Deque[int]:
-        # to sort: [8, 1, 6, 7, 2, 3]
-        # current floor: 5
-        # upper: [6, 7, 8]
-        # lower: [3, 2, 1]
-        # if direction UP: [6, 7, 8, 3, 2, 1]
-        # if direction DOWN: [3, 2, 1, 6, 7, 8]
-
-        # check queue empty
-        if not q:
-            logging.warning("queue to sort is empty")
-            return q
-
-        # separate the queue to upper and lower floor compared to the current floor
-        upper = sorted([f for f in q if f > current_floor])
-        # reverse lower because when at higher floor we want to go down
-        # e.g. current: 9; queue: [8, 7, 6] not [6, 7, 8]
-        lower = sorted([f for f in q if f < current_floor])
-        lower.reverse()
-
-        # if at lowest floor
-        if not lower:
-            return deque(upper)
-        # or at highest floor
-        if not upper:
-            return deque(lower)
-        # else we need to combine both upper and lower
-        if direction == "UP":
-            return deque(upper + lower)
-        else:
-            return deque(lower + upper)
-
-    def try_get_idle_elevator(self) -> ElevatorData:
-        # try get elevator with empty queue
-        for e in self.elevators:
-            if len(e.queue) == 0:
-                return e
-        return None
-
-    def try_get_empty_elevator(self):
-        for e in self.elevators:
-            if e.actual_capacity == 0:
-                e.queue.clear()
-                return e
-        return None
-
-    def get_nearest_elevator(self, source_floor: int) -> ElevatorData:
-        # try get elevator with empty queue
-        distance = [100 for e in range(0, 10)]  # start with high distance
-
-        for i, e in enumerate(self.elevators):
-            # TODO: direction of elevator important?
-            distance[i] = abs(e.floor - source_floor)
-
-        # TODO: only return if elevator not full (max_cap < 20)
-        return self.elevators[distance.index(min(distance))]
-
-    def select_elevator(self, source_floor: int) -> ElevatorData:
-        elevator = self.try_get_idle_elevator()
-        if elevator is not None:
-            return elevator
-
-        elevator = self.try_get_empty_elevator()
-        if elevator is not None:
-            return elevator
-
-        # no elevator with empty queue
-        return self.get_nearest_elevator(source_floor)
-
-    def get_called_floor_dumb(self) -> int:
-        combined_queue = []
-        for e in self.elevators:
-            combined_queue += e.queue
-
-        for f in self.floors:
-            if f.id in combined_queue or f.waiting_count == 0:
-                continue
-            if f.up_pressed or f.down_pressed:
-                return f.id
-        return None
-
-    def get_called_floor_smarter_dumb(self) -> int:
-        combined_queue = []
-        for e in self.elevators:
-            combined_queue += e.queue
-
-        for f in self.floors:
-            if (
-                combined_queue.count(f.id) > MAX_ELEVATOR_PER_FLOOR
-                or f.waiting_count == 0
-            ):
-                continue
-            if f.up_pressed or f.down_pressed:
-                return f.id
-        return None
-
-    def get_called_floor_smart_with_cap(self) -> int:
-        combined_queue = []
-        for e in self.elevators:
-            combined_queue += e.queue
-
-        pressed_floors = []
-        for f in self.floors:
-            if (
-                combined_queue.count(f.id) > MAX_ELEVATOR_PER_FLOOR
-                or f.waiting_count == 0
-            ):
-                continue
-            if (f.up_pressed or f.down_pressed) and f.waiting_count > 0:
-                pressed_floors.append({"id": f.id, "count": f.waiting_count})
-        max_count = max(pressed_floors, default=None, key=compare_waiting_count)
-        if max_count is not None:
-            # logging.debug(f"max_count floor: {max_count}")
-            return max_count["id"]
-        return None
-
-    def get_called_floor_smart(self) -> int:
-        combined_queue = []
-        for e in self.elevators:
-            combined_queue += e.queue
-
-        pressed_floors = []
-        for f in self.floors:
-            if (
-                f.id in combined_queue
-                and f.waiting_count <= MULTIPLE_ELEVATOR_THRESHOLD
-            ):
-                continue
-            if (f.up_pressed or f.down_pressed) and f.waiting_count > 0:
-                pressed_floors.append({"id": f.id, "count": f.waiting_count})
-        max_count = max(pressed_floors, default=None, key=compare_waiting_count)
-        if max_count is not None:
-            # logging.debug(f"max_count floor: {max_count}")
-            return max_count["id"]
-        return None
-
-    def scheduler(self):
-        logging.debug(f"Start Scheduling Thread")
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            self._callButtonEvent.wait()
-            if self.mode == SMART:
-                source_floor = self.get_called_floor_smart()
-            elif self.mode == SMART_WITH_CAP:
-                source_floor = self.get_called_floor_smart_with_cap()
-            elif self.mode == DUMB:
-                source_floor = self.get_called_floor_dumb()
-            elif self.mode == SMARTER_DUMB:
-                source_floor = self.get_called_floor_smarter_dumb()
-            else:
-                logging.error("unknown scheduling mode")
-            if source_floor is None:
-                continue
-
-            elevator = self.select_elevator(source_floor)
-            # logging.debug(f"source_floor: {source_floor}; elevator: {elevator.id}")
-            assert isinstance(elevator, ElevatorData)
-            if (
-                (source_floor not in elevator.queue)
-                and (source_floor != elevator.floor)
-                and (elevator.actual_capacity < elevator.max_capacity)
-            ):
-                elevator.queue.append(source_floor)
-                cv = self.dispatcher_locks[elevator.id]
-                with cv:
-                    cv.notify()
-
-            self.client.publish(
-                f"simulation/elevator/{elevator.id}/queue",
-                json.dumps(elevator.queue, cls=DequeEncoder),
-                qos=0,
-            )
-            time.sleep(0.1)
-
-    def elevator_dispatcher(self, id: int):
-        logging.debug(f"Start Dispatcher Thread")
-        t = threading.currentThread()
-
-        elevator = self.elevators[id]
-        cv = self.dispatcher_locks[id]
-        while getattr(t, "do_run", True):
-            self.client.publish(
-                f"simulation/elevator/{elevator.id}/queue",
-                json.dumps(elevator.queue, cls=DequeEncoder),
-                qos=0,
-            )
-
-            while len(elevator.queue) == 0:
-                with cv:
-                    cv.wait(timeout=2)
-
-            self.client.publish(
-                f"simulation/elevator/{elevator.id}/queue",
-                json.dumps(elevator.queue, cls=DequeEncoder),
-                qos=0,
-            )
-
-            next_floor: int = int(elevator.queue[0])
-            # logging.debug(f"elevator {elevator.id} next_floor: {next_floor}")
-            self.client.publish(
-                f"elevator/{elevator.id}/next_floor", next_floor, qos=0,
-            )
-
-            time.sleep(0.5)
+        self._published_next_floors[id] = next_floor
 
 
 class DequeEncoder(json.JSONEncoder):
@@ -398,10 +222,6 @@ class DequeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def compare_waiting_count(f):
-    return f["count"]
-
-
 if __name__ == "__main__":
     argp = argparse.ArgumentParser(description="Elevator Controller")
 
@@ -427,7 +247,37 @@ if __name__ == "__main__":
         action="store",
         dest="mode",
         default="smart",
-        help="default: smart\nAvailable: smart | dumb",
+        help="default: smart\n"
+        "Available: smart | dumb | smarter_dumb | smart_with_cap | eta | "
+        "destination",
+    )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-floors",
+        action="store",
+        dest="floors",
+        default=FLOOR_COUNT,
+        help=f"number of floors; default: {FLOOR_COUNT}",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
     )
 
     args = argp.parse_args()
@@ -435,13 +285,20 @@ if __name__ == "__main__":
     host = os.getenv("mqtt_host", args.host)
     port = os.getenv("mqtt_port", args.port)
     loglevel = os.getenv("log_level", args.log)
-    mode = os.getenv("mode", args.log).lower()
+    mode = os.getenv("mode", args.mode).lower()
+    elevator_count = os.getenv("elevator_count", args.elevators)
+    floor_count = os.getenv("floor_count", args.floors)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
 
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
 
     logging.info("Starting controller")
 
-    controller = Controller(mode)
+    controller = Controller(
+        mode, elevator_count=int(elevator_count), floor_count=int(floor_count)
+    )
     controller.run(host=host, port=int(port))
 
     logging.info("Exited controller")
@@ -3,135 +3,142 @@
 import os
 import logging
 import argparse
-import threading
-import time
-from cps_common.data import Passenger, PassengerEncoder
-from typing import List
+import asyncio
+from cps_common import clock
+from cps_common.data import JSON, BINARY, encode_elevator_state, encode_passengers, decode_passengers
+from cps_common.car import Car
+from cps_common.service import Service, sleep
 import json
 
 import paho.mqtt.client as mqtt
 
-class Elevator:
-
-    def __init__(self, id: int, start_floor: int = 0, max_cap: int = 20):
-        self.id = id
-        self.maxCap=max_cap
-        self.actualCap=0
-        self.destinations = set()
-        self.nextFloor=start_floor
-        self.currentFloor=0
-        self.door_status="open"
-        self.passenger_list: List[Passenger]=[]
-
-        self._lock = threading.Lock()
-        self._newNextFloor = threading.Event()
-
-        self.client = mqtt.Client(f"elevator{self.id}")
-
-    def run(self, host: str = "localhost", port: int = 1883):
-        # setup MQTT
-        self.client.on_connect = self.on_connect
-        self.client.on_disconnect = self.on_disconnect
-        self.client.will_set(topic=f"elevator/{self.id}/status", payload="offline", qos=2)
-        self.client.connect(host, port)
-
-        self.healthThread = threading.Thread(target=self.health)
-        self.capacityThread = threading.Thread(target=self.capacity)
-        self.floorThread = threading.Thread(target=self.floor)
-        self.moveThread = threading.Thread(target=self.move)
-
-        self.healthThread.start()
-        self.capacityThread.start()
-        self.floorThread.start()
-        self.moveThread.start()
-
-        self.client.loop_forever()
-
-    def on_connect(self, client, userdata, flags, rc):
-        logging.info("connected to broker!")
-
-        subscriptions = [
+# telemetry
+# elevator/{id}/state on change
+STATE = "state"
+# elevator/{id}/status, capacity, actual_floor and door every second
+LEGACY = "legacy"
+BOTH = "both"
+
+# seconds between two elevator/{id}/state messages if nothing changed
+KEEPALIVE_PERIOD = 10
+# seconds to travel one floor
+TRAVEL_TIME = 3
+
+class Elevator(Car, Service):
+
+    def __init__(self, id: int, start_floor: int = 0, max_cap: int = 20, telemetry: str = STATE, codec: str = JSON, client: mqtt.Client = None):
+        """
+        :param client: connection shared with other cars of an ElevatorHost, own
+            connection if None
+        """
+        Car.__init__(self, id, start_floor=start_floor, max_cap=max_cap)
+        Service.__init__(self, f"elevator{id}", client=client)
+
+        if telemetry not in (STATE, LEGACY, BOTH):
+            raise ValueError(f"unknown telemetry {telemetry}")
+        self.telemetry = telemetry
+        if codec not in (JSON, BINARY):
+            raise ValueError(f"unknown passenger codec {codec}")
+        self.codec = codec
+
+        self._newNextFloor = asyncio.Event()
+        self._stateChanged = asyncio.Event()
+        self._publishedState = None
+
+        if client is None:
+            if self.telemetry == STATE:
+                self.client.will_set(topic=f"elevator/{self.id}/state", payload=encode_elevator_state(status="offline"), qos=2)
+            else:
+                self.client.will_set(topic=f"elevator/{self.id}/status", payload="offline", qos=2)
+
+    def tasks(self):
+        tasks = [self.move()]
+        if self.telemetry in (LEGACY, BOTH):
+            tasks += [self.health(), self.capacity(), self.floor()]
+        if self.telemetry in (STATE, BOTH):
+            self._stateChanged.set()
+            tasks.append(self.state())
+        return tasks
+
+    def subscriptions(self):
+        return [
             (f"elevator/{self.id}/next_floor", self.on_elevator_next_floor),
             (f"simulation/elevator/{self.id}/passenger", self.on_simulation_passenger),
         ]
 
-        # subscribe to multiple topics in a single SUBSCRIBE command
-        # QOS=1
-        self.client.subscribe([(s[0], 1) for s in subscriptions])
-        # add callback for each subscription
-        for s in subscriptions:
-            self.client.message_callback_add(s[0], s[1])
-
-    def health(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            self.client.publish(topic=f"elevator/{self.id}/status", payload="online", qos=1)
-            time.sleep(60)
-
-    def capacity(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            self.client.publish(topic=f"elevator/{self.id}/capacity", payload=f'{{"max": {self.maxCap}, "actual": {self.actualCap}}}', qos=1)
-            time.sleep(1)
-
-    def floor(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            self.client.publish(topic=f"elevator/{self.id}/actual_floor", payload=f"{self.currentFloor}", qos=1)
-            self.client.publish(topic=f"elevator/{self.id}/door", payload=f"{self.door_status}", qos=1)
-            time.sleep(1)
-
-    def on_disconnect(self, client, userdata, rc):
-        logging.info("disconnected from broker")
+    async def health(self):
+        while True:
+            self.publish_health()
+            await sleep(60)
+
+    async def capacity(self):
+        while True:
+            self.publish_capacity()
+            await sleep(1)
+
+    async def floor(self):
+        while True:
+            self.publish_floor()
+            await sleep(1)
+
+    async def state(self):
+        while True:
+            # wakes up on changes, otherwise repeats the state as keep-alive
+            try:
+                await asyncio.wait_for(self._stateChanged.wait(), clock.to_wall(KEEPALIVE_PERIOD))
+                changed = True
+            except asyncio.TimeoutError:
+                changed = False
+            self._stateChanged.clear()
+            self.publish_state(keepalive=not changed)
+
+    def publish_health(self):
+        self.client.publish(topic=f"elevator/{self.id}/status", payload="online", qos=1)
+
+    def publish_capacity(self):
+        self.client.publish(topic=f"elevator/{self.id}/capacity", payload=f'{{"max": {self.maxCap}, "actual": {self.actualCap}}}', qos=1)
+
+    def publish_floor(self):
+        self.client.publish(topic=f"elevator/{self.id}/actual_floor", payload=f"{self.currentFloor}", qos=1)
+        self.client.publish(topic=f"elevator/{self.id}/door", payload=f"{self.door_status}", qos=1)
+
+    def publish_state(self, keepalive: bool = False):
+        """Publishes the state if it changed since the last time, or as keep-alive."""
+        payload = encode_elevator_state(status="online", floor=self.currentFloor, door=self.door_status, actual=self.actualCap, max=self.maxCap)
+        if not keepalive and payload == self._publishedState:
+            return
+        self.client.publish(topic=f"elevator/{self.id}/state", payload=payload, qos=1)
+        self._publishedState = payload
 
     def on_elevator_next_floor(self, client, userdata, msg):
         logging.info(f"New message from {msg.topic}: {msg.payload}")
+        if not msg.payload:
+            # the controller cleared the retained next floor, the queue is empty
+            return
         next_floor = int(msg.payload)
 
-        # this lock causes deadlock and times out and disconnect from MQTT broker
-        # with self._lock:
-        if self.nextFloor != next_floor:
-            self.nextFloor = next_floor
-            self.destinations.add(next_floor)
+        if self.set_next_floor(next_floor):
             self._newNextFloor.set()
 
     def on_simulation_passenger(self, client, userdata, msg):
         logging.info(f"New message from {msg.topic}")
 
-        new_passenger = json.loads(msg.payload, object_hook=Passenger.from_json_dict)
+        new_passenger = decode_passengers(msg.payload)
+        selected = self.board(new_passenger)
+        self._stateChanged.set()
 
-        for p in new_passenger:
-            p.log_enter_elevator()
-            self.destinations.add(p.end_floor)
-            self.passenger_list.append(p)
-            self.actualCap += 1
+        self.client.publish(topic=f"elevator/{self.id}/selected_floors", payload=json.dumps(selected, cls=SetEncoder), qos=1)
 
-        self.client.publish(topic=f"elevator/{self.id}/selected_floors", payload=json.dumps(set([p.end_floor for p in self.passenger_list]), cls=SetEncoder), qos=1)
-
-    def move(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            self._newNextFloor.wait()
+    async def move(self):
+        while True:
+            await self._newNextFloor.wait()
+            self._newNextFloor.clear()
             while self.currentFloor != self.nextFloor:
-                time.sleep(3)
-                self.door_status="closed"
-                with self._lock:
-                    if self.currentFloor > self.nextFloor:
-                        self.currentFloor -= 1
-                    elif self.currentFloor < self.nextFloor:
-                        self.currentFloor += 1
-
-                    if self.currentFloor == self.nextFloor:
-                        leaving = [p for p in self.passenger_list if p.end_floor == self.currentFloor]
-                        self.passenger_list = [p for p in self.passenger_list if p not in leaving]
-                        msg = []
-                        for p in leaving:
-                            p.log_leave_elevator()
-                            self.actualCap -= 1
-                            msg.append(p)
-                        self.destinations.discard(self.currentFloor)
-                        self.door_status="open"
-                        self.client.publish(topic=f"simulation/floor/{self.currentFloor}/passenger_arrived", payload=json.dumps(msg, cls=PassengerEncoder), qos=2)
+                await sleep(TRAVEL_TIME)
+                leaving = self.step()
+                self._stateChanged.set()
+                if leaving is not None:
+                    self.client.publish(topic=f"simulation/floor/{self.currentFloor}/passenger_arrived", payload=encode_passengers(leaving, self.codec), qos=2)
 
 
 class SetEncoder(json.JSONEncoder):
@@ -170,6 +177,35 @@ if __name__ == "__main__":
     argp.add_argument(
         "-capacity", action="store", dest="capacity", default=20, help="default: 20",
     )
+    argp.add_argument(
+        "-telemetry",
+        action="store",
+        dest="telemetry",
+        default=STATE,
+        help="default: state\nAvailable: state | legacy | both",
+    )
+    argp.add_argument(
+        "-codec",
+        action="store",
+        dest="codec",
+        default=JSON,
+        help="encoding of published passenger lists; default: json\n"
+        "Available: json | binary",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
+    )
 
     args = argp.parse_args()
 
@@ -179,12 +215,17 @@ if __name__ == "__main__":
     id = os.getenv("elevator_id", args.elevatorid)
     start_floor = os.getenv("start_floor", args.start)
     capacity = os.getenv("capacity", args.capacity)
+    telemetry = os.getenv("telemetry", args.telemetry)
+    codec = os.getenv("codec", args.codec)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
 
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
 
     logging.info(f"Starting elevator {id}")
 
-    controller = Elevator(id=int(id), start_floor=int(start_floor), max_cap=capacity)
+    controller = Elevator(id=int(id), start_floor=int(start_floor), max_cap=int(capacity), telemetry=telemetry.lower(), codec=codec.lower())
     controller.run(host=host, port=int(port))
 
     logging.info(f"Exited elevator {id}")
@@ -0,0 +1,143 @@
+# elevator_host.py
+
+import os
+import logging
+import argparse
+
+from typing import Dict, List
+from cps_common import clock
+from cps_common.data import JSON, parse_ids
+from cps_common.service import Service
+from elevator import Elevator, STATE
+
+
+class ElevatorHost(Service):
+    """
+    Runs several elevators in one process on a single MQTT connection.
+
+    The tasks of all cars run on the one asyncio loop of the host instead of
+    four threads per car.
+
+    A connection has only one will, so unlike single elevators the hosted cars
+    are not reported offline by the broker if the host dies.
+    """
+
+    def __init__(
+        self,
+        ids: List[int],
+        start_floor: int = 0,
+        max_cap: int = 20,
+        telemetry: str = STATE,
+        codec: str = JSON,
+    ):
+        super().__init__(f"elevators{ids[0]}-{ids[-1]}")
+        self.cars: Dict[int, Elevator] = {
+            id: Elevator(
+                id,
+                start_floor=start_floor,
+                max_cap=max_cap,
+                telemetry=telemetry,
+                codec=codec,
+                client=self.client,
+            )
+            for id in ids
+        }
+
+    def tasks(self):
+        return [t for car in self.cars.values() for t in car.tasks()]
+
+    def subscriptions(self):
+        return [s for car in self.cars.values() for s in car.subscriptions()]
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Elevator host")
+
+    argp.add_argument(
+        "-mqtthost",
+        action="store",
+        dest="host",
+        default="localhost",
+        help="default: localhost",
+    )
+    argp.add_argument(
+        "-mqttport", action="store", dest="port", default=1883, help="default: 1883"
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="ERROR",
+        help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+    argp.add_argument(
+        "-ids",
+        action="store",
+        dest="elevator_ids",
+        default="0-5",
+        help='elevator IDs, e.g. "0-4,7"; default: 0-5',
+    )
+    argp.add_argument(
+        "-start", action="store", dest="start", default=0, help="default: 0",
+    )
+    argp.add_argument(
+        "-capacity", action="store", dest="capacity", default=20, help="default: 20",
+    )
+    argp.add_argument(
+        "-telemetry",
+        action="store",
+        dest="telemetry",
+        default=STATE,
+        help="default: state\nAvailable: state | legacy | both",
+    )
+    argp.add_argument(
+        "-codec",
+        action="store",
+        dest="codec",
+        default=JSON,
+        help="encoding of published passenger lists; default: json\n"
+        "Available: json | binary",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
+    )
+
+    args = argp.parse_args()
+
+    host = os.getenv("mqtt_host", args.host)
+    port = os.getenv("mqtt_port", args.port)
+    loglevel = os.getenv("log_level", args.log)
+    ids = parse_ids(os.getenv("elevator_ids", args.elevator_ids))
+    start_floor = os.getenv("start_floor", args.start)
+    capacity = os.getenv("capacity", args.capacity)
+    telemetry = os.getenv("telemetry", args.telemetry)
+    codec = os.getenv("codec", args.codec)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
+
+    logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
+
+    logging.info(f"Starting elevators {ids}")
+
+    elevator_host = ElevatorHost(
+        ids,
+        start_floor=int(start_floor),
+        max_cap=int(capacity),
+        telemetry=telemetry.lower(),
+        codec=codec.lower(),
+    )
+    elevator_host.run(host=host, port=int(port))
+
+    logging.info(f"Exited elevators {ids}")
@@ -3,53 +3,84 @@
 import os
 import logging
 import argparse
-import threading
-import time
-import random
 import json
+import random
 import paho.mqtt.client as mqtt
 
+from cps_common import clock
 from typing import List
-from cps_common.data import Passenger, PassengerEncoder, ElevatorData
-
-
-class Floor:
-    def __init__(self, id: int):
-        self.floor: int = id
-        self.client = mqtt.Client(f"floor{self.floor}")
-
-        self.waiting_list: List[Passenger] = []
-        self.arrived_list: List[Passenger] = []
-        self.elevators: List[ElevatorData] = [ElevatorData(id) for id in range(0, 6)]
-
-        self.waiting_count_thread = threading.Thread(target=self.update_waiting_count)
-        self.push_call_button_thread = threading.Thread(
-            target=self.push_call_button_wrapper
-        )
-
-    def run(self, host: str = "localhost", port: int = 1883):
-        # setup MQTT
-        self.client.on_connect = self.on_connect
-        self.client.on_disconnect = self.on_disconnect
-        self.client.connect(host, port)
-
-        self.waiting_count_thread.start()
-        self.push_call_button_thread.start()
-
-        self.client.loop_forever()
-
-    def update_waiting_count(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            time.sleep(1)
-            self.client.publish(
-                f"floor/{self.floor}/waiting_count", json.dumps(len(self.waiting_list))
-            )
-
-    def on_connect(self, client, userdata, flags, rc):
-        logging.info("connected to broker!")
+from cps_common.data import (
+    Passenger,
+    ElevatorData,
+    ELEVATOR_COUNT,
+    JSON,
+    BINARY,
+    decode_elevator_state,
+    encode_passengers,
+    decode_passengers,
+)
+from cps_common.hall import Hall
+from cps_common.service import Service, sleep
+
+
+def update_elevator(elevator: ElevatorData, state: dict):
+    """Applies a decoded elevator/{id}/state message, except the door."""
+    elevator.status = state.get("status", elevator.status)
+    elevator.floor = state.get("floor", elevator.floor)
+    elevator.actual_capacity = state.get("actual", elevator.actual_capacity)
+    elevator.max_capacity = state.get("max", elevator.max_capacity)
+
+
+def floor_rng(seed: str, id: int) -> random.Random:
+    """
+    :param seed: seed of all floors, None for a random one
+    :return: the random generator of the floor, which shuffles the waiting
+        passengers; the same seed gives each floor the same sequence, whether
+        it runs alone or in a FloorHost
+    """
+    return random.Random(None if seed is None else f"{seed}:{id}")
+
+
+class Floor(Hall, Service):
+    def __init__(
+        self,
+        id: int,
+        elevator_count: int = ELEVATOR_COUNT,
+        codec: str = JSON,
+        client: mqtt.Client = None,
+        elevators: List[ElevatorData] = None,
+        rng: random.Random = None,
+    ):
+        """
+        :param client: connection shared with other floors of a FloorHost,
+            own connection if None
+        :param elevators: elevator state shared with other floors of a FloorHost
+        :param rng: random generator of the boarding order, see floor_rng
+        """
+        Hall.__init__(self, id, elevator_count=elevator_count, rng=rng)
+        Service.__init__(self, f"floor{id}", client=client)
+        if codec not in (JSON, BINARY):
+            raise ValueError(f"unknown passenger codec {codec}")
+        self.codec = codec
+        if elevators is not None:
+            self.elevators = elevators
+        self._published_demand = {}
+
+    def tasks(self):
+        return [self.update_waiting_count(), self.push_call_button_wrapper()]
+
+    def subscriptions(self):
+        return self.floor_subscriptions() + [
+            (f"elevator/+/state", self.on_elevator_state),
+            (f"elevator/+/door", self.on_elevator_door),
+            (f"elevator/+/capacity", self.on_elevator_capacity),
+            (f"elevator/+/status", self.on_elevator_status),
+            (f"elevator/+/actual_floor", self.on_elevator_actual_floor),
+        ]
 
-        subscriptions = [
+    def floor_subscriptions(self):
+        """:return: the subscriptions of the topics of this floor only"""
+        return [
             (
                 f"simulation/floor/{self.floor}/passenger_waiting",
                 self.on_passenger_waiting,
@@ -58,21 +89,18 @@ class Floor:
                 f"simulation/floor/{self.floor}/passenger_arrived",
                 self.on_passenger_arrived,
             ),
-            (f"elevator/+/door", self.on_elevator_door),
-            (f"elevator/+/capacity", self.on_elevator_capacity),
-            (f"elevator/+/status", self.on_elevator_status),
-            (f"elevator/+/actual_floor", self.on_elevator_actual_floor),
+            (f"floor/{self.floor}/allocation", self.on_floor_allocation),
         ]
 
-        # subscribe to multiple topics in a single SUBSCRIBE command
-        # QOS=1
-        self.client.subscribe([(s[0], 1) for s in subscriptions])
-        # add callback for each subscription
-        for s in subscriptions:
-            self.client.message_callback_add(s[0], s[1])
+    async def update_waiting_count(self):
+        while True:
+            await sleep(1)
+            self.publish_waiting_count()
 
-    def on_disconnect(self, client, userdata, rc):
-        logging.info("disconnected from broker")
+    def publish_waiting_count(self):
+        self.client.publish(
+            f"floor/{self.floor}/waiting_count", json.dumps(self.waiting_count)
+        )
 
     def on_elevator_actual_floor(self, client, userdata, msg):
         elevator_id = int(msg.topic.split("/")[1])
@@ -99,6 +127,24 @@ class Floor:
         # logging.debug(f"id {elevator_id}: status: {status}")
         self.elevators[elevator_id].status = status
 
+    def on_floor_allocation(self, client, userdata, msg):
+        # destination mode: elevator id by destination floor
+        allocation = json.loads(msg.payload)
+        self.allocation = {int(d): e for d, e in allocation.items()}
+        self.board_waiting()
+
+    def on_elevator_state(self, client, userdata, msg):
+        elevator_id = int(msg.topic.split("/")[1])
+        try:
+            state = decode_elevator_state(msg.payload)
+        except ValueError:
+            logging.error(f"unsupported message on {msg.topic}")
+            return
+
+        update_elevator(self.elevators[elevator_id], state)
+        if "door" in state:
+            self.board_elevator(elevator_id, state["door"])
+
     def on_elevator_door(self, client, userdata, msg):
         # logging.info(f"New message from {msg.topic}")
 
@@ -107,24 +153,26 @@ class Floor:
         # logging.debug(
         #     f"status: {status}; elevator floor: {self.elevators[elevator_id].floor}"
         # )
-
-        if (self.elevators[elevator_id].floor == self.floor) and (
-            status == "open" and len(self.waiting_list) > 0
-        ):
-            enter_list: List[Passenger] = []
-            free = (
-                self.elevators[elevator_id].max_capacity
-                - self.elevators[elevator_id].actual_capacity
-            )
-            while len(enter_list) < free and len(self.waiting_list) > 0:
-                enter_list.append(self.waiting_list.pop())
-
-            payload = json.dumps(enter_list, cls=PassengerEncoder)
+        self.board_elevator(elevator_id, status)
+
+    def board_waiting(self):
+        # elevators only publish their state on change, so passengers arriving
+        # while an elevator waits here with open door have to board now
+        for e in self.elevators:
+            # no state received yet if the capacity is unknown
+            if e.floor == self.floor and e.door == "open" and e.max_capacity > 0:
+                self.board_elevator(e.id, e.door)
+
+    def board_elevator(self, elevator_id: int, door: str):
+        self.elevators[elevator_id].door = door
+        enter_list = self.board(elevator_id, door)
+        if enter_list is not None:
+            payload = encode_passengers(enter_list, self.codec)
             self.client.publish(
                 f"simulation/elevator/{elevator_id}/passenger", payload, qos=2
             )
             self.client.publish(
-                f"floor/{self.floor}/waiting_count", len(self.waiting_list), qos=1
+                f"floor/{self.floor}/waiting_count", self.waiting_count, qos=1
             )
 
             # re-push or disable call button if there is still passenger waiting
@@ -145,30 +193,30 @@ class Floor:
 
         # this is the first time we received the pasesnger object so create it first
         # convert the JSON to Passenger objects
-        self.waiting_list += [
-            Passenger(id=p["id"], start_floor=p["start"], end_floor=p["destination"])
-            for p in waiting_list
-        ]
-        random.shuffle(self.waiting_list)
-        logging.debug(f"waiting list count: {len(self.waiting_list)}")
+        self.add_waiting(
+            [
+                Passenger(
+                    id=p["id"], start_floor=p["start"], end_floor=p["destination"]
+                )
+                for p in waiting_list
+            ]
+        )
+        logging.debug(f"waiting list count: {self.waiting_count}")
 
         self.client.publish(
-            f"floor/{self.floor}/waiting_count", len(self.waiting_list), qos=1
+            f"floor/{self.floor}/waiting_count", self.waiting_count, qos=1
         )
         self.push_call_button()
+        self.board_waiting()
 
     def on_passenger_arrived(self, client, userdata, msg):
         logging.info(f"New message from {msg.topic}")
 
         # convert the payload to JSON
-        arrived_list = json.loads(msg.payload, object_hook=Passenger.from_json_dict)
+        arrived_list = decode_passengers(msg.payload)
 
         # log end time
-        logged_passenger: List[Passenger] = []
-        for p in arrived_list:
-            p.log_end()
-            logged_passenger.append(p)
-        self.arrived_list += logged_passenger
+        self.arrive(arrived_list)
         logging.debug(f"arrived list: {self.arrived_list}")
         self.client.publish(
             f"simulation/floor/{self.floor}/arrived_count",
@@ -178,24 +226,19 @@ class Floor:
         # publish logged passenger to record
         self.client.publish(
             f"record/floor/{self.floor}/passenger_arrived",
-            json.dumps(logged_passenger, cls=PassengerEncoder),
+            encode_passengers(arrived_list, self.codec),
             qos=2,
         )
 
-    def push_call_button_wrapper(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True):
-            time.sleep(1)
+    async def push_call_button_wrapper(self):
+        while True:
+            await sleep(1)
             self.push_call_button()
 
     def push_call_button(self):
         # logging.info("pushing call button")
 
-        up: bool = False
-        down: bool = False
-        for p in self.waiting_list:
-            up = up or (p.end_floor > self.floor)
-            down = down or (p.end_floor < self.floor)
+        up, down = self.call_buttons()
         # logging.debug(f"button pushed: up: {up}; down: {down}")
 
         if up:
@@ -203,6 +246,15 @@ class Floor:
         if down:
             self.client.publish(f"floor/{self.floor}/button_pressed/down", down, qos=1)
 
+        # waiting passengers by destination for destination mode, repeated while
+        # passengers are waiting like the call buttons
+        demand = self.destination_demand()
+        if demand or demand != self._published_demand:
+            self.client.publish(
+                f"floor/{self.floor}/destinations", json.dumps(demand), qos=1
+            )
+            self._published_demand = demand
+
 
 if __name__ == "__main__":
     argp = argparse.ArgumentParser(description="Floor")
@@ -227,6 +279,43 @@ if __name__ == "__main__":
     argp.add_argument(
         "-id", action="store", default=5, dest="floor_id", help="Floor ID",
     )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-codec",
+        action="store",
+        dest="codec",
+        default=JSON,
+        help="encoding of published passenger lists; default: json\n"
+        "Available: json | binary",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
+    )
+
+    argp.add_argument(
+        "-seed",
+        action="store",
+        dest="seed",
+        default=None,
+        help="seed of the boarding order; default: random",
+    )
 
     args = argp.parse_args()
 
@@ -234,12 +323,23 @@ if __name__ == "__main__":
     port = os.getenv("mqtt_port", args.port)
     loglevel = os.getenv("log_level", args.log)
     id = os.getenv("floor_id", args.floor_id)
+    elevator_count = os.getenv("elevator_count", args.elevators)
+    codec = os.getenv("codec", args.codec)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
+    seed = os.getenv("seed", args.seed)
 
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
 
     logging.info(f"Starting floor {id}")
 
-    controller = Floor(id=int(id))
+    controller = Floor(
+        id=int(id),
+        elevator_count=int(elevator_count),
+        codec=codec.lower(),
+        rng=floor_rng(seed, int(id)),
+    )
     controller.run(host=host, port=int(port))
 
     logging.info(f"Exited elevator {id}")
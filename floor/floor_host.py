@@ -0,0 +1,198 @@
+# floor_host.py
+
+import os
+import logging
+import argparse
+
+from typing import Dict, List
+from cps_common import clock
+from cps_common.data import (
+    ElevatorData,
+    ELEVATOR_COUNT,
+    FLOOR_COUNT,
+    JSON,
+    decode_elevator_state,
+    parse_ids,
+)
+from cps_common.service import Service, sleep
+from floor import Floor, floor_rng, update_elevator
+
+
+class FloorHost(Service):
+    """
+    Runs several floors in one process on a single MQTT connection.
+
+    The elevator topics are subscribed and parsed once into a copy of the
+    elevator state shared by all floors, and each update is passed on only to
+    the floor the elevator is at. The topics of a single floor go straight to
+    its handlers.
+    """
+
+    def __init__(
+        self,
+        ids: List[int],
+        elevator_count: int = ELEVATOR_COUNT,
+        codec: str = JSON,
+        seed: str = None,
+    ):
+        """:param seed: seed of the boarding order of all floors, see floor_rng"""
+        super().__init__(f"floors{ids[0]}-{ids[-1]}")
+        self.elevators: List[ElevatorData] = [
+            ElevatorData(id) for id in range(0, elevator_count)
+        ]
+        self.floors: Dict[int, Floor] = {
+            id: Floor(
+                id,
+                elevator_count=elevator_count,
+                codec=codec,
+                client=self.client,
+                elevators=self.elevators,
+                rng=floor_rng(seed, id),
+            )
+            for id in ids
+        }
+
+    def tasks(self):
+        return [self.update_waiting_count(), self.push_call_button_wrapper()]
+
+    def subscriptions(self):
+        # the floors share the elevator state, so the handlers of any floor
+        # update it for all of them
+        first = next(iter(self.floors.values()))
+        subscriptions = [
+            (f"elevator/+/state", self.on_elevator_state),
+            (f"elevator/+/door", self.on_elevator_door),
+            (f"elevator/+/capacity", first.on_elevator_capacity),
+            (f"elevator/+/status", first.on_elevator_status),
+            (f"elevator/+/actual_floor", first.on_elevator_actual_floor),
+        ]
+        for floor in self.floors.values():
+            subscriptions += floor.floor_subscriptions()
+        return subscriptions
+
+    async def update_waiting_count(self):
+        while True:
+            await sleep(1)
+            for floor in self.floors.values():
+                floor.publish_waiting_count()
+
+    async def push_call_button_wrapper(self):
+        while True:
+            await sleep(1)
+            for floor in self.floors.values():
+                floor.push_call_button()
+
+    def on_elevator_state(self, client, userdata, msg):
+        elevator_id = int(msg.topic.split("/")[1])
+        try:
+            state = decode_elevator_state(msg.payload)
+        except ValueError:
+            logging.error(f"unsupported message on {msg.topic}")
+            return
+
+        update_elevator(self.elevators[elevator_id], state)
+        if "door" in state:
+            self.board_elevator(elevator_id, state["door"])
+
+    def on_elevator_door(self, client, userdata, msg):
+        elevator_id = int(msg.topic.split("/")[1])
+        self.board_elevator(elevator_id, msg.payload.decode("utf-8"))
+
+    def board_elevator(self, elevator_id: int, door: str):
+        # only the floor the elevator is at can board it
+        elevator = self.elevators[elevator_id]
+        floor = self.floors.get(elevator.floor)
+        if floor is None:
+            elevator.door = door
+        else:
+            floor.board_elevator(elevator_id, door)
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Floor host")
+
+    argp.add_argument(
+        "-mqtthost",
+        action="store",
+        dest="host",
+        default="localhost",
+        help="default: localhost",
+    )
+    argp.add_argument(
+        "-mqttport", action="store", dest="port", default=1883, help="default: 1883"
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="INFO",
+        help="default: INFO\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+    argp.add_argument(
+        "-ids",
+        action="store",
+        dest="floor_ids",
+        default=f"0-{FLOOR_COUNT - 1}",
+        help=f'floor IDs, e.g. "0-4,7"; default: 0-{FLOOR_COUNT - 1}',
+    )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-codec",
+        action="store",
+        dest="codec",
+        default=JSON,
+        help="encoding of published passenger lists; default: json\n"
+        "Available: json | binary",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
+    )
+
+    argp.add_argument(
+        "-seed",
+        action="store",
+        dest="seed",
+        default=None,
+        help="seed of the boarding order; default: random",
+    )
+
+    args = argp.parse_args()
+
+    host = os.getenv("mqtt_host", args.host)
+    port = os.getenv("mqtt_port", args.port)
+    loglevel = os.getenv("log_level", args.log)
+    ids = parse_ids(os.getenv("floor_ids", args.floor_ids))
+    elevator_count = os.getenv("elevator_count", args.elevators)
+    codec = os.getenv("codec", args.codec)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
+    seed = os.getenv("seed", args.seed)
+
+    logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
+
+    logging.info(f"Starting floors {ids}")
+
+    floor_host = FloorHost(
+        ids, elevator_count=int(elevator_count), codec=codec.lower(), seed=seed
+    )
+    floor_host.run(host=host, port=int(port))
+
+    logging.info(f"Exited floors {ids}")
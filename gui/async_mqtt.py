@@ -4,8 +4,8 @@ import time
 import json
 import paho.mqtt.client as mqtt
 
-from dashboard import DashboardUI, ELEVATOR_COUNT
-from components import ElevatorUI, FloorUI, FLOOR_COUNT
+from dashboard import DashboardUI
+from components import ElevatorUI, FloorUI
 
 
 class MQTTclient:
@@ -25,6 +25,7 @@ class MQTTclient:
         # (topic, callback)
         self.callbacks = [
             ("floor/+/waiting_count", self.on_floor_waiting_count),
+            ("elevator/+/state", self.on_elevator_state),
             ("elevator/+/actual_floor", self.on_elevator_actual_floor),
             ("elevator/+/capacity", self.on_elevator_capacity),
             ("elevator/+/door", self.on_elevator_door),
@@ -57,7 +58,7 @@ class MQTTclient:
 
     def on_arrived_count(self, client, userdata, msg):
         floor = int(msg.topic.split("/")[2])
-        if floor >= FLOOR_COUNT:
+        if floor >= self.dashboard.floor_count:
             # ignore error and exit
             return
 
@@ -68,7 +69,7 @@ class MQTTclient:
 
     def on_floor_waiting_count(self, client, userdata, msg):
         floor = int(msg.topic.split("/")[1])
-        if floor >= FLOOR_COUNT:
+        if floor >= self.dashboard.floor_count:
             # ignore error and exit
             return
 
@@ -78,9 +79,28 @@ class MQTTclient:
         floor: FloorUI = self.dashboard.get_floor(floor)
         floor.set_waiting_count(count)
 
+    def on_elevator_state(self, client, userdata, msg):
+        id = int(msg.topic.split("/")[1])
+        if id >= self.dashboard.elevator_count:
+            # ignore error and exit
+            return
+
+        state = json.loads(msg.payload)
+        if state.get("v") != 1:
+            # unknown version of the state message
+            return
+
+        elevator: ElevatorUI = self.dashboard.get_elevator(id)
+        if "floor" in state:
+            elevator.set_floor(state["floor"])
+        if "actual" in state:
+            elevator.set_capacity(state["actual"])
+        if "door" in state:
+            elevator.set_state(state["door"].upper())
+
     def on_elevator_door(self, client, userdata, msg):
         id = int(msg.topic.split("/")[1])
-        if id >= ELEVATOR_COUNT:
+        if id >= self.dashboard.elevator_count:
             # ignore error and exit
             return
 
@@ -89,7 +109,7 @@ class MQTTclient:
 
     def on_elevator_actual_floor(self, client, userdata, msg):
         id = int(msg.topic.split("/")[1])
-        if id >= ELEVATOR_COUNT:
+        if id >= self.dashboard.elevator_count:
             # ignore error and exit
             return
 
@@ -101,7 +121,7 @@ class MQTTclient:
 
     def on_elevator_capacity(self, client, userdata, msg):
         id = int(msg.topic.split("/")[1])
-        if id >= ELEVATOR_COUNT:
+        if id >= self.dashboard.elevator_count:
             # ignore error and exit
             return
 
@@ -113,7 +133,7 @@ class MQTTclient:
 
     def on_elevator_queue(self, client, userdata, msg):
         id = int(msg.topic.split("/")[2])
-        if id >= ELEVATOR_COUNT:
+        if id >= self.dashboard.elevator_count:
             # ignore error and exit
             return
 
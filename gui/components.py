@@ -36,8 +36,16 @@ class FloorUI(urwid.WidgetWrap):
 class ElevatorUI(urwid.WidgetWrap):
     id: int
 
-    def __init__(self, id: int, state="OPEN", position: int = 0, capacity: int = 0):
+    def __init__(
+        self,
+        id: int,
+        state="OPEN",
+        position: int = 0,
+        capacity: int = 0,
+        floor_count: int = FLOOR_COUNT,
+    ):
         self.position = position
+        self.floor_count = floor_count
         self.id = id
         self.capacity = capacity
         self.state = state
@@ -90,7 +98,7 @@ class ElevatorUI(urwid.WidgetWrap):
         )
 
     def calculate_top_offset(self, position):
-        return FLOOR_OFFSET * (FLOOR_COUNT - position - 1)
+        return FLOOR_OFFSET * (self.floor_count - position - 1)
 
     def calculate_bottom_offset(self, position) -> int:
         return FLOOR_OFFSET * position
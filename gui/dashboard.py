@@ -18,7 +18,6 @@ from components import (  # pylint: disable=import-error
 
 ELEVATOR_COUNT = 6
 
-STATUS_HEIGHT = FLOOR_OFFSET * FLOOR_COUNT + 3
 STATISTICS_HEIGHT = 9
 
 TEXTBOX_WIDTH = 10
@@ -39,7 +38,11 @@ class DashboardUI:
 
     urwid_loop: urwid.MainLoop
 
-    def __init__(self):
+    def __init__(
+        self, floor_count: int = FLOOR_COUNT, elevator_count: int = ELEVATOR_COUNT
+    ):
+        self.floor_count = floor_count
+        self.elevator_count = elevator_count
         self.frame = self.build_dashboard()
 
         self.urwid_loop: urwid.MainLoop = urwid.MainLoop(
@@ -63,7 +66,7 @@ class DashboardUI:
         floor_height = 1
         floors = []
         floors.append(("fixed", 1, hline))
-        for i in range(FLOOR_COUNT - 1, -1, -1):
+        for i in range(self.floor_count - 1, -1, -1):
             floors.append((floor_height, FloorUI(i)))
             floors.append(("fixed", 1, hline))
 
@@ -73,8 +76,14 @@ class DashboardUI:
         # ELEVATOR
 
         elevators = []
-        for i in range(0, ELEVATOR_COUNT):
-            elevators.append(("fixed", ELEVATOR_WIDTH, ElevatorUI(id=i)))
+        for i in range(0, self.elevator_count):
+            elevators.append(
+                (
+                    "fixed",
+                    ELEVATOR_WIDTH,
+                    ElevatorUI(id=i, floor_count=self.floor_count),
+                )
+            )
         self.elevators = urwid.Columns(elevators, min_width=7)
         elevators = urwid.Filler(self.elevators, "top")
 
@@ -82,7 +91,7 @@ class DashboardUI:
             [
                 floors,
                 ("fixed", 1, vline),
-                (ELEVATOR_WIDTH * ELEVATOR_COUNT, self.elevators),
+                (ELEVATOR_WIDTH * self.elevator_count, self.elevators),
             ]
         )
         status = urwid.LineBox(status, title="Status")
@@ -92,7 +101,8 @@ class DashboardUI:
         self.total_expected = 0
         self.total_arrived = 0
         self.passenger_count = [
-            {"floor": i, "arrived": 0, "expected": 0} for i in range(0, FLOOR_COUNT)
+            {"floor": i, "arrived": 0, "expected": 0}
+            for i in range(0, self.floor_count)
         ]
 
         arrived_elements = [
@@ -146,7 +156,8 @@ class DashboardUI:
         # QUEUE
 
         queue_elements = [
-            urwid.Text(f"E{i}: []", wrap="ellipsis") for i in range(0, ELEVATOR_COUNT)
+            urwid.Text(f"E{i}: []", wrap="ellipsis")
+            for i in range(0, self.elevator_count)
         ]
         self.queue = urwid.Pile(queue_elements)
         self.queue._selectable = False
@@ -167,16 +178,17 @@ class DashboardUI:
         statistics = urwid.Filler(statistics)
 
         # FIXME: replace len(arrived_elements) with more general height
-        return urwid.Pile([(STATISTICS_HEIGHT, statistics), (STATUS_HEIGHT, status)])
+        status_height = FLOOR_OFFSET * self.floor_count + 3
+        return urwid.Pile([(STATISTICS_HEIGHT, statistics), (status_height, status)])
 
     def get_passenger_count_entry(self, floor: int) -> urwid.Text:
         # left or right
-        if floor < FLOOR_COUNT / 2:
+        if floor < self.floor_count / 2:
             section = self.arrived_values.contents[0][0]
             idx_in_section = int(floor)
         else:
             section = self.arrived_values.contents[1][0]
-            idx_in_section = int(floor - FLOOR_COUNT / 2)
+            idx_in_section = int(floor - self.floor_count / 2)
 
         # access time in the section
         return section.contents[idx_in_section][0]
@@ -260,10 +272,10 @@ class DashboardUI:
         return self.floors.contents[idx][0]
 
     def reset(self):
-        for i in range(0, ELEVATOR_COUNT):
+        for i in range(0, self.elevator_count):
             self.get_elevator(i).set_floor(0)
             self.get_elevator(i).set_statebox_text(state="OPEN", capacity=0)
-        for i in range(0, FLOOR_COUNT):
+        for i in range(0, self.floor_count):
             self.get_floor(i).set_waiting_count(0)
 
 
@@ -271,12 +283,16 @@ def signal_handler(signal, frame):
     raise urwid.ExitMainLoop()
 
 
-def main(host: str = "localhost"):
+def main(
+    host: str = "localhost",
+    floor_count: int = FLOOR_COUNT,
+    elevator_count: int = ELEVATOR_COUNT,
+):
     signal.signal(signal.SIGINT, signal_handler)
 
     from async_mqtt import MQTTclient  # pylint: disable=import-error
 
-    dashboard = DashboardUI()
+    dashboard = DashboardUI(floor_count=floor_count, elevator_count=elevator_count)
 
     mqtt_client = MQTTclient(dashboard=dashboard, host=host)
     mqtt_thread = threading.Thread(target=mqtt_client.run)
@@ -296,7 +312,23 @@ if __name__ == "__main__":
         default="localhost",
         help="default: localhost",
     )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-floors",
+        action="store",
+        dest="floors",
+        default=FLOOR_COUNT,
+        help=f"number of floors; default: {FLOOR_COUNT}",
+    )
     args = argp.parse_args()
     host = os.getenv("mqtt_host", args.host)
+    elevator_count = os.getenv("elevator_count", args.elevators)
+    floor_count = os.getenv("floor_count", args.floors)
 
-    main(host)
+    main(host, floor_count=int(floor_count), elevator_count=int(elevator_count))
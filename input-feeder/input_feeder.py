@@ -4,33 +4,83 @@
 import argparse
 import asyncio
 import os
-import yaml
+import sys
 import json
-from time import sleep
+import numpy as np
 import paho.mqtt.client as mqtt
+from cps_common import clock
+from cps_common.data import FLOOR_COUNT
+from typing import Dict, Iterable
+from cps_common.timeline import load_timeline, timeline_entries
+from cps_common.traffic import generate_traffic, load_profile
+from cps_common.replay import count_destinations, replay_trace
+
+# messages published but not acknowledged by the broker yet
+MAX_IN_FLIGHT = 100
+
+
+class InFlight:
+    """
+    The messages published with QoS 2 until the broker acknowledged them, by mid.
+
+    Publishing waits while `limit` messages are in flight, so the feeder doesn't
+    flood the broker when many passengers arrive at the same time.
+    """
+
+    def __init__(self, client: mqtt.Client, limit: int = MAX_IN_FLIGHT):
+        self.client = client
+        self.limit = limit
+        self.messages: Dict[int, mqtt.MQTTMessageInfo] = {}
+        self._loop = None
+        self._space = asyncio.Event()
+        self._space.set()
+        self._empty = asyncio.Event()
+        self._empty.set()
+
+        client.max_inflight_messages_set(limit)
+        client.on_publish = self.on_publish
+
+    def on_publish(self, client, userdata, mid):
+        # called on the network thread of the client
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._acknowledge, mid)
+
+    def _acknowledge(self, mid: int):
+        if self.messages.pop(mid, None) is None:
+            return
+        if len(self.messages) < self.limit:
+            self._space.set()
+        if not self.messages:
+            self._empty.set()
+
+    async def publish(self, topic: str, payload: str):
+        while len(self.messages) >= self.limit:
+            self._space.clear()
+            await self._space.wait()
+        # acknowledgements are handled on this loop, so they can't overtake
+        # adding the message below
+        self._loop = asyncio.get_running_loop()
+        info = self.client.publish(topic, payload, qos=2)
+        self.messages[info.mid] = info
+        self._empty.clear()
+
+    async def join(self):
+        """Waits until all published messages are acknowledged."""
+        await self._empty.wait()
 
 
 def init_mqtt(host: str, port: int) -> mqtt.Client:
     mqttc = mqtt.Client(client_id="input_feeder")
-    mqttc.on_publish = on_publish
     mqttc.connect(host, port)
     return mqttc
 
 
-def on_publish(client, userdata, mid):
-    for m in scheduled_msg:
-        if m.mid == mid:
-            scheduled_msg.remove(m)
-            break
-
-
 def get_floor_topic(floor: int):
     return f"simulation/floor/{floor}/passenger_waiting"
 
 
-async def delayed_publish(delay: int, floor: int, passengers):
+async def publish_passengers(floor: int, passengers):
     """
-    :param delay: the delay before publish
     :param floor: start floor of the passengers
     :param passengers: list of passengers arriving
     """
@@ -40,56 +90,99 @@ async def delayed_publish(delay: int, floor: int, passengers):
     ]
 
     topic = get_floor_topic(floor)
+    await in_flight.publish(topic, json.dumps(passengers))
+
+
+async def delayed_publish(delay: int, floor: int, passengers):
+    """
+    :param delay: the delay before publish
+    :param floor: start floor of the passengers
+    :param passengers: list of passengers arriving
+    """
+    await asyncio.sleep(clock.to_wall(delay))
+    await publish_passengers(floor, passengers)
 
-    await asyncio.sleep(delay)
-    scheduled_msg.append(mqttc.publish(topic, json.dumps(passengers), qos=2))
 
+async def publish_expected(expected: dict):
+    await in_flight.publish("simulation/passengers/expected", json.dumps(expected))
 
-async def main(samples: str):
-    schedule = []
-    samples = yaml.load(samples, Loader=yaml.BaseLoader)
 
-    FLOOR_COUNT = 10
-    expected = {str(i): 0 for i in range(0, FLOOR_COUNT)}
+async def feed(entries: Iterable, expected: dict = None) -> int:
+    """
+    Publishes the passengers of (time, start floor, passengers) entries in time
+    order when their time comes. Only the next entry is taken from the entries,
+    so generated traffic is never held in memory as a whole.
 
-    id = 0
-    for s in samples:
-        time = int(s["time"])
-        for p in s["passengers"]:
-            start_floor = int(p["start"])
-            passengers = []
-            for destination, count in p["destinations"].items():
-                for _ in range(0, int(count)):
-                    passengers.append(
-                        {"id": id, "start": start_floor, "destination": destination}
-                    )
-                    id += 1
+    :param expected: the expected passengers by destination floor, published up
+        front; if None, the passengers are added to the expected ones as they
+        are fed
+    :return: the number of passengers fed
+    """
+    if expected is not None:
+        await publish_expected(expected)
+    # expected passengers not published yet, the GUI adds them up
+    pending = {}
 
-            schedule.append(delayed_publish(time, start_floor, passengers))
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    fed = 0
+    for time, floor, passengers in entries:
+        delay = clock.to_wall(time) - (loop.time() - started)
+        if delay > 0:
+            if pending:
+                await publish_expected(pending)
+                pending = {}
+            await asyncio.sleep(delay)
+        await publish_passengers(floor, passengers)
+        fed += len(passengers)
+        if expected is None:
             for p in passengers:
-                expected[str(p["destination"])] += 1
-    mqttc.publish("simulation/passengers/expected", json.dumps(expected), qos=2)
-    await asyncio.gather(*schedule)
+                destination = str(p["destination"])
+                pending[destination] = pending.get(destination, 0) + 1
+    if pending:
+        await publish_expected(pending)
+
+    await in_flight.join()
+    return fed
+
+
+async def main(samples_file: str, floor_count: int = FLOOR_COUNT):
+    # the compiled scenario is in time order and only mapped into memory
+    timeline = load_timeline(samples_file)
+    counts = np.bincount(timeline["destination"], minlength=floor_count)
+    expected = {str(i): int(n) for i, n in enumerate(counts)}
 
-    while len(scheduled_msg) != 0:
-        await asyncio.sleep(1)
+    await feed(timeline_entries(timeline), expected)
     print(f"finished feeding inputs: {expected}")
 
 
+async def main_generated(profile: dict, seed: int = None):
+    fed = await feed(generate_traffic(profile, seed=seed))
+    print(f"finished feeding {fed} generated passengers")
+
+
+async def main_replay(
+    path: str, time_factor: float = 1, floor_count: int = FLOOR_COUNT
+):
+    # counting the passengers is another pass over the file, not a copy of it
+    expected = {str(i): 0 for i in range(0, floor_count)}
+    for floor, count in count_destinations(path).items():
+        expected[str(floor)] = count
+
+    fed = await feed(replay_trace(path, time_factor=time_factor), expected)
+    print(f"finished replaying {fed} passengers of {path}")
+
+
 async def main_single(id: int, start: int, dst: int):
     passenger = {"id": id, "start": start, "destination": dst}
     await delayed_publish(0, start, [passenger])
-    mqttc.publish("simulation/passengers/expected", json.dumps({str(dst): 1}), qos=2)
+    await publish_expected({str(dst): 1})
 
-    while len(scheduled_msg) != 0:
-        await asyncio.sleep(1)
+    await in_flight.join()
     print(f"finished feeding single input: start: {start}, destination: {dst}")
 
 
 if __name__ == "__main__":
-    # list of all msg scheduled to be published, cannot exit program until this list is empty
-    scheduled_msg = []
-
     argp = argparse.ArgumentParser(description="simulator for mqtt messages")
     argp.add_argument(
         "-host",
@@ -104,29 +197,105 @@ if __name__ == "__main__":
     argp.add_argument(
         "-samples", action="store", dest="samples", help="use passenger samples",
     )
-
+    argp.add_argument(
+        "-profile",
+        action="store",
+        dest="profile",
+        help="generate the passengers from a traffic profile instead of samples",
+    )
+    argp.add_argument(
+        "-replay",
+        action="store",
+        dest="replay",
+        help="replay the passengers of a recorder CSV instead of samples",
+    )
+    argp.add_argument(
+        "-timefactor",
+        action="store",
+        dest="time_factor",
+        default=1,
+        help="multiplies the times between the replayed passengers; default: 1",
+    )
+    argp.add_argument(
+        "-seed",
+        action="store",
+        dest="seed",
+        default=None,
+        help="seed of the generated passengers; default: random",
+    )
     argp.add_argument(
         "-single",
         action="store",
         dest="single",
         help="single passenger in form of '(START,END)'",
     )
+    argp.add_argument(
+        "-floors",
+        action="store",
+        dest="floors",
+        default=FLOOR_COUNT,
+        help=f"number of floors; default: {FLOOR_COUNT}",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-maxinflight",
+        action="store",
+        dest="max_in_flight",
+        default=MAX_IN_FLIGHT,
+        help="messages published before waiting for the acknowledgement of the "
+        f"broker; default: {MAX_IN_FLIGHT}",
+    )
     args = argp.parse_args()
 
     host = os.getenv("mqtt_host", args.host)
     port = os.getenv("mqtt_port", args.port)
     samples_file = os.getenv("samples_list", args.samples)
+    profile_file = os.getenv("traffic_profile", args.profile)
+    seed = os.getenv("seed", args.seed)
+    replay_file = os.getenv("replay_file", args.replay)
+    time_factor = os.getenv("time_factor", args.time_factor)
+    time_scale = os.getenv("time_scale", args.timescale)
+    floor_count = os.getenv("floor_count", args.floors)
+    max_in_flight = os.getenv("max_in_flight", args.max_in_flight)
+
+    # services started with the broker clock follow the clock of this run
+    clock.configure(scale=float(time_scale))
 
     mqttc = init_mqtt(host, port)
+    # cannot exit the program until all messages are acknowledged
+    in_flight = InFlight(mqttc, limit=int(max_in_flight))
     mqttc.loop_start()
+    clock.publish(mqttc)
 
     if args.single:
         params = args.single.split(",")
         start = int(params[0])
         dst = int(params[1])
         asyncio.run(main_single(0, start, dst))
+    elif replay_file:
+        asyncio.run(
+            main_replay(
+                replay_file, float(time_factor), floor_count=int(floor_count)
+            )
+        )
+    elif profile_file:
+        profile = load_profile(profile_file)
+        floors = int(profile.setdefault("floors", int(floor_count)))
+        if floors != int(floor_count):
+            # the passengers would wait for floors that don't exist or never be
+            # generated for some of the floors
+            sys.exit(
+                f"{profile_file} is for {floors} floors, the building has "
+                f"{floor_count}; set -floors or floor_count to {floors}"
+            )
+        asyncio.run(main_generated(profile, None if seed is None else int(seed)))
     else:
-        samples = open(samples_file, "r").read()
-        asyncio.run(main(samples))
+        asyncio.run(main(samples_file, floor_count=int(floor_count)))
 
     mqttc.disconnect()
@@ -0,0 +1,172 @@
+# metrics.py
+
+import os
+import json
+import logging
+import asyncio
+import argparse
+
+from typing import Dict, List
+from cps_common import clock
+from cps_common.data import Passenger, decode_passengers
+from cps_common.service import Service
+from cps_common.sketch import QuantileSketch
+
+# wall clock seconds between two summaries
+PUBLISH_PERIOD = 5
+# quantiles in the summaries
+QUANTILES = [0.5, 0.95, 0.99]
+# label of the runs before the controller published its mode
+UNKNOWN_MODE = "unknown"
+
+
+class FloorMetrics:
+    """Running wait and ride time statistics of the passengers of one floor."""
+
+    def __init__(self):
+        self.wait = QuantileSketch()
+        self.ride = QuantileSketch()
+
+    def add(self, p: Passenger):
+        if p.start_ns is not None and p.enter_elevator_ns is not None:
+            self.wait.add((p.enter_elevator_ns - p.start_ns) / 1e9)
+        if p.enter_elevator_ns is not None and p.leave_elevator_ns is not None:
+            self.ride.add((p.leave_elevator_ns - p.enter_elevator_ns) / 1e9)
+
+    def merge(self, other: "FloorMetrics"):
+        self.wait.merge(other.wait)
+        self.ride.merge(other.ride)
+
+    def to_dict(self) -> dict:
+        return {"wait": summarize(self.wait), "ride": summarize(self.ride)}
+
+
+def summarize(sketch: QuantileSketch) -> dict:
+    summary = {"n": sketch.count}
+    if sketch.count:
+        summary["mean"] = round(sketch.mean, 3)
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = round(sketch.quantile(q), 3)
+    return summary
+
+
+class Metrics(Service):
+    """
+    Live KPIs of the running simulation.
+
+    Keeps running statistics of the recorded passengers by scheduling mode and
+    start floor, and publishes a summary of each mode on metrics/kpi/{mode}
+    every `period` seconds of wall clock time, whatever the time scale.
+    """
+
+    def __init__(self, period: float = PUBLISH_PERIOD):
+        super().__init__("metrics")
+        self.period = period
+        self.mode = UNKNOWN_MODE
+        # metrics by mode and start floor
+        self.metrics: Dict[str, Dict[int, FloorMetrics]] = {}
+
+    def tasks(self):
+        return [self.publisher()]
+
+    def subscriptions(self):
+        return [
+            ("controller/mode", self.on_controller_mode),
+            ("record/floor/+/passenger_arrived", self.on_record),
+        ]
+
+    def on_controller_mode(self, client, userdata, msg):
+        self.mode = msg.payload.decode("utf-8")
+        logging.info(f"collecting metrics of mode {self.mode}")
+
+    def on_record(self, client, userdata, msg):
+        arrived: List[Passenger] = decode_passengers(msg.payload)
+
+        floors = self.metrics.setdefault(self.mode, {})
+        for p in arrived:
+            floor = floors.get(p.start_floor)
+            if floor is None:
+                floor = floors[p.start_floor] = FloorMetrics()
+            floor.add(p)
+
+    async def publisher(self):
+        while True:
+            await asyncio.sleep(self.period)
+            for mode in sorted(self.metrics):
+                self.client.publish(
+                    f"metrics/kpi/{mode}",
+                    json.dumps(self.summary(mode), separators=(",", ":")),
+                    retain=True,
+                )
+
+    def summary(self, mode: str) -> dict:
+        """:return: the statistics of all floors and of each floor of a mode"""
+        floors = self.metrics.get(mode, {})
+        total = FloorMetrics()
+        for floor in floors.values():
+            total.merge(floor)
+        summary = {"mode": mode, "time": clock.now().isoformat()}
+        summary.update(total.to_dict())
+        summary["floors"] = {str(f): floors[f].to_dict() for f in sorted(floors)}
+        return summary
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Live KPIs")
+    argp.add_argument(
+        "-mqtthost",
+        action="store",
+        dest="host",
+        default="localhost",
+        help="default: localhost",
+    )
+    argp.add_argument(
+        "-mqttport", action="store", dest="port", default=1883, help="default: 1883"
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="ERROR",
+        help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+    argp.add_argument(
+        "-period",
+        action="store",
+        dest="period",
+        default=PUBLISH_PERIOD,
+        help=f"wall clock seconds between two summaries; default: {PUBLISH_PERIOD}",
+    )
+    argp.add_argument(
+        "-timescale",
+        action="store",
+        dest="timescale",
+        default=1,
+        help="speed of the simulation relative to the wall clock; default: 1",
+    )
+    argp.add_argument(
+        "-clock",
+        action="store",
+        dest="clock",
+        default="local",
+        help="default: local\nAvailable: local | broker",
+    )
+
+    args = argp.parse_args()
+
+    host = os.getenv("mqtt_host", args.host)
+    port = os.getenv("mqtt_port", args.port)
+    loglevel = os.getenv("log_level", args.log)
+    period = os.getenv("metrics_period", args.period)
+    time_scale = os.getenv("time_scale", args.timescale)
+    clock_source = os.getenv("clock", args.clock)
+
+    logging.basicConfig(level=getattr(logging, loglevel.upper()))
+    clock.configure(scale=float(time_scale), source=clock_source)
+
+    logging.info("Starting metrics")
+
+    metrics = Metrics(period=float(period))
+    metrics.run(host=host, port=int(port))
+
+    logging.info("Exited metrics")
@@ -1,45 +1,132 @@
 # recorder.py
 
 import os
-import json
 import csv
+import asyncio
 import logging
 import argparse
-import paho.mqtt.client as mqtt
 from datetime import datetime as dt
-from cps_common.data import Passenger
+from cps_common.data import Passenger, RECORD_FIELDS, decode_passengers
+from cps_common.results import CSV, NPZ, ResultWriter
+from cps_common.service import Service
 from typing import List
 
-
-def on_connect(client, userdata, flags, rc):
-    logging.debug("CONNECTED")
-    client.subscribe("simulation/stop")
-    client.message_callback_add("simulation/stop", on_stop)
-
-    client.subscribe("record/floor/+/passenger_arrived", qos=0)
-    client.message_callback_add("record/floor/+/passenger_arrived", on_record)
-
-
-def on_record(client, userdata, msg):
-    arrived: List[Passenger] = json.loads(
-        msg.payload, object_hook=Passenger.from_json_dict
-    )
-    assert isinstance(arrived, list)
-
-    for p in arrived:
-        logging.debug(f"wrote {p.to_dict()}")
-        writer.writerow(p.to_dict())
-        resfile.flush()
-
-
-def on_stop(client, userdata, msg):
-    logging.debug("STOPPING SIMULATION")
-    client.disconnect()
-
-
-def on_disconnect(client, userdata, rc):
-    logging.debug("DISCONNECT")
-    resfile.close()
+# rows buffered before they are written
+BATCH_SIZE = 500
+# wall clock seconds after which buffered rows are written anyway
+FLUSH_INTERVAL = 1
+
+
+class Recorder(Service):
+    """
+    Writes the passengers arriving at their destination to a CSV file, or to a
+    columnar .npz file with one row group per batch.
+
+    Rows are buffered and written in batches of `batch_size`, at the latest
+    `flush_interval` seconds after they arrived, and when the simulation stops
+    or the connection is lost.
+
+    The scheduling mode in the .npz metadata is the one the controller
+    publishes, so the .npz file is created with the first batch.
+    """
+
+    def __init__(
+        self,
+        resname: str,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        result_format: str = CSV,
+        metadata: dict = None,
+    ):
+        """
+        :param metadata: run metadata stored in .npz files, e.g. the scenario
+        """
+        super().__init__("recorder")
+        self.resname = resname
+        self.result_format = result_format
+        self.metadata = {"mode": None, **(metadata or {})}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows: List[Passenger] = []
+
+        if result_format == NPZ:
+            self.results = None
+            self.resfile = None
+        elif result_format == CSV:
+            self.results = None
+            self.resfile = open(resname, mode="x", newline="")
+            self.writer = csv.DictWriter(self.resfile, RECORD_FIELDS)
+            self.writer.writeheader()
+            self.resfile.flush()
+        else:
+            raise ValueError(f"unknown result format {result_format}")
+
+    def tasks(self):
+        return [self.flusher()]
+
+    def subscriptions(self):
+        return [
+            ("controller/mode", self.on_controller_mode),
+            ("simulation/stop", self.on_stop),
+            ("record/floor/+/passenger_arrived", self.on_record),
+        ]
+
+    def on_controller_mode(self, client, userdata, msg):
+        mode = msg.payload.decode("utf-8")
+        if self.results is None:
+            self.metadata["mode"] = mode
+        elif mode != self.metadata["mode"]:
+            logging.warning(
+                f"controller changed to mode {mode}, "
+                f"{self.resname} is recorded as {self.metadata['mode']}"
+            )
+
+    def on_record(self, client, userdata, msg):
+        # JSON or binary, whatever the floors are configured to send
+        arrived: List[Passenger] = decode_passengers(msg.payload)
+        assert isinstance(arrived, list)
+
+        self._rows += arrived
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def on_stop(self, client, userdata, msg):
+        logging.debug("STOPPING SIMULATION")
+        self.flush()
+        self.stop()
+
+    def on_disconnect(self, client, userdata, rc):
+        super().on_disconnect(client, userdata, rc)
+        self.flush()
+
+    async def flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def open_results(self):
+        if self.result_format == NPZ and self.results is None:
+            self.results = ResultWriter(self.resname, self.metadata)
+
+    def flush(self):
+        """Writes the buffered rows to the file."""
+        if not self._rows:
+            return
+        self.open_results()
+        if self.results is not None:
+            self.results.write(self._rows)
+        else:
+            self.writer.writerows(p.to_dict() for p in self._rows)
+            self.resfile.flush()
+        logging.debug(f"wrote {len(self._rows)} rows")
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        # a run without passengers still leaves its metadata
+        self.open_results()
+        if self.resfile is not None:
+            self.resfile.close()
 
 
 if __name__ == "__main__":
@@ -65,35 +152,64 @@ if __name__ == "__main__":
         default="DEBUG",
         help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
     )
+    argp.add_argument(
+        "-batch",
+        action="store",
+        dest="batch",
+        default=BATCH_SIZE,
+        help=f"rows written at once; default: {BATCH_SIZE}",
+    )
+    argp.add_argument(
+        "-flushinterval",
+        action="store",
+        dest="flush_interval",
+        default=FLUSH_INTERVAL,
+        help="wall clock seconds until buffered rows are written; "
+        f"default: {FLUSH_INTERVAL}",
+    )
+
+    argp.add_argument(
+        "-format",
+        action="store",
+        dest="format",
+        default=CSV,
+        help="default: csv\nAvailable: csv | npz",
+    )
+    argp.add_argument(
+        "-scenario",
+        action="store",
+        dest="scenario",
+        default=None,
+        help="scenario stored in the .npz metadata",
+    )
 
     args = argp.parse_args()
     host = os.getenv("mqtt_host", args.host)
     resdir = os.getenv("resdir", args.resdir)
     loglevel = os.getenv("log_level", args.log)
+    batch_size = os.getenv("batch_size", args.batch)
+    flush_interval = os.getenv("flush_interval", args.flush_interval)
+    result_format = os.getenv("result_format", args.format).lower()
+    metadata = {
+        "scenario": os.getenv("samples_list", args.scenario),
+        "started": dt.now().isoformat(),
+    }
 
     logging.basicConfig(level=getattr(logging, loglevel.upper()))
 
     if not os.path.exists(resdir):
         os.makedirs(resdir)
-    resname = resdir + "/log-" + dt.now().strftime("%F-%H:%M:%S") + ".csv"
+    resname = f"{resdir}/log-{dt.now().strftime('%F-%H:%M:%S')}.{result_format}"
     logging.debug(f"writing log to {resname}")
-    resfile = open(resname, mode="x", newline="")
-    headers = [
-        "id",
-        "start_floor",
-        "end_floor",
-        "start_timestamp",
-        "enter_elevator_timestamp",
-        "leave_elevator_timestamp",
-        "end_timestamp",
-    ]
-    writer = csv.DictWriter(resfile, headers)
-    writer.writeheader()
-    resfile.flush()
-
-    client = mqtt.Client(client_id="recorder")
-    client.on_connect = on_connect
-    client.connect(host)
-
-    client.loop_forever()
+    recorder = Recorder(
+        resname,
+        batch_size=int(batch_size),
+        flush_interval=float(flush_interval),
+        result_format=result_format,
+        metadata=metadata,
+    )
+    try:
+        recorder.run(host)
+    finally:
+        recorder.close()
     logging.debug("FINISHED")
@@ -0,0 +1,345 @@
+# benchmark.py
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from sweep import get_scenario, summarize
+from cps_common.data import ELEVATOR_COUNT, FLOOR_COUNT
+from cps_common.simulation import Simulation
+from cps_common.timeline import timeline_entries
+from cps_common.traffic import generate_traffic, load_profile
+from cps_common.scheduling import (
+    SMART,
+    DUMB,
+    SMARTER_DUMB,
+    SMART_WITH_CAP,
+    ETA,
+    DESTINATION,
+)
+
+BASELINE_VERSION = 1
+# relative change of a KPI that counts as regression
+TOLERANCE = 0.05
+# the CPU time depends on the machine and its load, so it has its own tolerance
+CPU_TOLERANCE = 1.0
+# smaller changes of the wait and ride times in seconds are never regressions
+MIN_CHANGE = 0.5
+# same for the CPU time per decision in microseconds, small scenarios only have
+# a few decisions
+MIN_CPU_CHANGE = 10
+
+# KPIs of each case, averaged over the seeds, and if higher is better
+METRICS = {
+    "avg_wait": False,
+    "p95_wait": False,
+    "avg_ride": False,
+    "p95_ride": False,
+    "throughput": True,
+    "cpu_us_per_decision": False,
+}
+COLUMNS = ["case", "arrived", "expected"] + list(METRICS)
+
+
+def run_case(case: dict) -> dict:
+    """Runs one mode on one scenario with one seed in this process."""
+    floor_count = case["floors"]
+    if case["kind"] == "profile":
+        profile = load_profile(case["path"])
+        # a profile is made for its building, e.g. its O-D matrix
+        floor_count = int(profile.setdefault("floors", floor_count))
+
+    sim = Simulation(
+        case["mode"],
+        seed=case["seed"],
+        elevator_count=case["elevators"],
+        floor_count=floor_count,
+    )
+    if case["kind"] == "profile":
+        sim.add_stream(generate_traffic(profile, seed=case["seed"]))
+    else:
+        sim.add_scenario(timeline_entries(get_scenario(case["path"])))
+    records = sim.run(until=case["until"])
+
+    kpis = summarize(records)
+    return {
+        "case": case["case"],
+        "arrived": len(records),
+        "expected": sim.expected,
+        "avg_wait": kpis["avg_wait"],
+        "p95_wait": kpis["p95_wait"],
+        "avg_ride": kpis["avg_ride"],
+        "p95_ride": kpis["p95_ride"],
+        # arrived passengers per hour of simulated time
+        "throughput": len(records) / sim.now * 3600 if sim.now else None,
+        "decisions": sim.decisions,
+        "decision_ns": sim.decision_ns,
+    }
+
+
+def build_cases(
+    modes: List[str],
+    scenarios: List[str],
+    profiles: List[str],
+    seeds: List[int],
+    until: float,
+    elevators: int = ELEVATOR_COUNT,
+    floors: int = FLOOR_COUNT,
+) -> List[dict]:
+    sources = [("samples", s) for s in scenarios] + [("profile", p) for p in profiles]
+    return [
+        {
+            "case": f"{m}/{os.path.splitext(os.path.basename(path))[0]}",
+            "mode": m,
+            "kind": kind,
+            "path": path,
+            "seed": seed,
+            "until": until,
+            "elevators": elevators,
+            "floors": floors,
+        }
+        for m, (kind, path), seed in itertools.product(modes, sources, seeds)
+    ]
+
+
+def average(results: List[dict]) -> Dict[str, dict]:
+    """:return: the KPIs of each case averaged over its seeds"""
+    by_case: Dict[str, List[dict]] = {}
+    for r in results:
+        by_case.setdefault(r["case"], []).append(r)
+
+    cases = {}
+    for name, runs in by_case.items():
+        case = {
+            "arrived": sum(r["arrived"] for r in runs),
+            "expected": sum(r["expected"] for r in runs),
+        }
+        # the CPU time of all decisions of all seeds, the averages of the seeds
+        # with a few decisions would be noise
+        decisions = sum(r["decisions"] for r in runs)
+        case["cpu_us_per_decision"] = (
+            sum(r["decision_ns"] for r in runs) / decisions / 1000
+            if decisions
+            else None
+        )
+        for metric in METRICS:
+            if metric == "cpu_us_per_decision":
+                continue
+            values = [r[metric] for r in runs if r[metric] is not None]
+            case[metric] = sum(values) / len(values) if values else None
+        cases[name] = case
+    return cases
+
+
+def check(cases: Dict[str, dict]) -> List[Tuple[str, str]]:
+    """
+    :return: the name of each case with passengers that didn't arrive until the
+        end of the run and a description, their KPIs only cover the others
+    """
+    return [
+        (name, f"only {case['arrived']} of {case['expected']} passengers arrived")
+        for name, case in sorted(cases.items())
+        if case["arrived"] < case["expected"]
+    ]
+
+
+def compare(
+    cases: Dict[str, dict],
+    baseline: Dict[str, dict],
+    tolerance: float = TOLERANCE,
+    cpu_tolerance: float = CPU_TOLERANCE,
+) -> List[str]:
+    """
+    :return: a description of each case that didn't deliver all passengers and
+        of each KPI that got worse than in the baseline
+    """
+    regressions = [f"{name}: {undelivered}" for name, undelivered in check(cases)]
+    for name in sorted(cases):
+        if name not in baseline:
+            continue
+        case, base = cases[name], baseline[name]
+        for metric, higher_is_better in METRICS.items():
+            value, reference = case.get(metric), base.get(metric)
+            if value is None or reference is None:
+                continue
+            if metric == "cpu_us_per_decision":
+                allowed = max(reference * cpu_tolerance, MIN_CPU_CHANGE)
+            elif metric == "throughput":
+                allowed = reference * tolerance
+            else:
+                allowed = max(reference * tolerance, MIN_CHANGE)
+            change = reference - value if higher_is_better else value - reference
+            if change > allowed:
+                regressions.append(
+                    f"{name}: {metric} {value:.2f} vs. {reference:.2f} in the baseline"
+                )
+    return regressions
+
+
+def format_table(cases: Dict[str, dict]) -> str:
+    def fmt(v):
+        if v is None:
+            return "-"
+        if isinstance(v, float):
+            return f"{v:.1f}"
+        return str(v)
+
+    rows = [COLUMNS] + [
+        [name] + [fmt(cases[name][c]) for c in COLUMNS[1:]] for name in sorted(cases)
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return "\n".join(
+        "  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in rows
+    )
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Scheduler Benchmark")
+    argp.add_argument(
+        "-samples",
+        action="store",
+        dest="samples",
+        default="../input-feeder/samples/*.yaml",
+        help="glob of passenger samples; default: ../input-feeder/samples/*.yaml",
+    )
+    argp.add_argument(
+        "-profiles",
+        action="store",
+        dest="profiles",
+        default="../input-feeder/profiles/*.yaml",
+        help="glob of traffic profiles; default: ../input-feeder/profiles/*.yaml",
+    )
+    argp.add_argument(
+        "-modes",
+        action="store",
+        dest="modes",
+        default=",".join([SMART, DUMB, SMARTER_DUMB, SMART_WITH_CAP, ETA, DESTINATION]),
+        help="comma separated; default: all modes",
+    )
+    argp.add_argument(
+        "-seeds", action="store", dest="seeds", default="0,1,2", help="default: 0,1,2",
+    )
+    argp.add_argument(
+        "-until",
+        action="store",
+        dest="until",
+        default=86400,
+        help="stop each run after this many simulated seconds; default: 86400",
+    )
+    argp.add_argument(
+        "-baseline",
+        action="store",
+        dest="baseline",
+        default="benchmark.json",
+        help="default: benchmark.json",
+    )
+    argp.add_argument(
+        "-update",
+        action="store_true",
+        dest="update",
+        help="write the results as new baseline instead of comparing",
+    )
+    argp.add_argument(
+        "-tolerance",
+        action="store",
+        dest="tolerance",
+        default=TOLERANCE,
+        help=f"relative change of a KPI that is a regression; default: {TOLERANCE}",
+    )
+    argp.add_argument(
+        "-cputolerance",
+        action="store",
+        dest="cpu_tolerance",
+        default=CPU_TOLERANCE,
+        help="relative change of the CPU time per decision that is a regression; "
+        f"default: {CPU_TOLERANCE}",
+    )
+    argp.add_argument(
+        "-workers",
+        action="store",
+        dest="workers",
+        default=None,
+        help="number of processes; default: number of cores",
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="ERROR",
+        help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+
+    args = argp.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    scenarios = []
+    for path in sorted(glob.glob(args.samples)):
+        try:
+            get_scenario(path)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"skipping {path}: unsupported scenario format ({e})")
+            continue
+        scenarios.append(path)
+    seeds = int_list(args.seeds)
+
+    cases = build_cases(
+        modes=args.modes.split(","),
+        scenarios=scenarios,
+        profiles=sorted(glob.glob(args.profiles)),
+        seeds=seeds,
+        until=float(args.until),
+    )
+
+    workers = os.cpu_count() if args.workers is None else int(args.workers)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = average(list(executor.map(run_case, cases)))
+    elapsed = time.perf_counter() - started
+
+    print(format_table(results))
+    print(f"\n{len(cases)} runs in {elapsed:.2f}s")
+
+    if args.update or not os.path.exists(args.baseline):
+        undelivered = check(results)
+        if undelivered:
+            print(f"\nnot writing {args.baseline}, {len(undelivered)} cases failed:")
+            print("\n".join(f"{name}: {reason}" for name, reason in undelivered))
+            sys.exit(1)
+        with open(args.baseline, "w") as f:
+            baseline = {"version": BASELINE_VERSION, "seeds": seeds, "cases": results}
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"wrote baseline {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        sys.exit(f"unsupported baseline version in {args.baseline}")
+    if baseline["seeds"] != seeds:
+        logging.warning(f"baseline was run with seeds {baseline['seeds']}")
+
+    missing = set(baseline["cases"]) - set(results)
+    if missing:
+        print(f"{len(missing)} cases of the baseline were not run")
+    regressions = compare(
+        results,
+        baseline["cases"],
+        tolerance=float(args.tolerance),
+        cpu_tolerance=float(args.cpu_tolerance),
+    )
+    if regressions:
+        print(f"\n{len(regressions)} regressions against {args.baseline}:")
+        print("\n".join(regressions))
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
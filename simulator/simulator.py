@@ -0,0 +1,167 @@
+# simulator.py
+
+import os
+import csv
+import time
+import logging
+import argparse
+from datetime import datetime as dt
+from cps_common.data import RECORD_FIELDS, ELEVATOR_COUNT, FLOOR_COUNT
+from cps_common.results import CSV, NPZ, ResultWriter
+from cps_common.simulation import Simulation
+from cps_common.timeline import load_timeline, timeline_entries
+from cps_common.traffic import generate_traffic, load_profile
+from cps_common.replay import replay_trace
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="In-process Elevator Simulation")
+    argp.add_argument(
+        "-samples", action="store", dest="samples", help="use passenger samples",
+    )
+    argp.add_argument(
+        "-profile",
+        action="store",
+        dest="profile",
+        help="generate the passengers from a traffic profile instead of samples",
+    )
+    argp.add_argument(
+        "-replay",
+        action="store",
+        dest="replay",
+        help="replay the passengers of a recorder CSV instead of samples",
+    )
+    argp.add_argument(
+        "-timefactor",
+        action="store",
+        dest="time_factor",
+        default=1,
+        help="multiplies the times between the replayed passengers; default: 1",
+    )
+    argp.add_argument(
+        "-mode",
+        action="store",
+        dest="mode",
+        default="smart",
+        help="default: smart\n"
+        "Available: smart | dumb | smarter_dumb | smart_with_cap | eta | "
+        "destination",
+    )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-floors",
+        action="store",
+        dest="floors",
+        default=FLOOR_COUNT,
+        help=f"number of floors; default: {FLOOR_COUNT}",
+    )
+    argp.add_argument(
+        "-seed", action="store", dest="seed", default=None, help="default: random",
+    )
+    argp.add_argument(
+        "-until",
+        action="store",
+        dest="until",
+        default=3600,
+        help="stop after this many simulated seconds; default: 3600",
+    )
+    argp.add_argument(
+        "-resdir",
+        action="store",
+        dest="resdir",
+        default="logs",
+        help="default: logs",
+    )
+    argp.add_argument(
+        "-out",
+        action="store",
+        dest="out",
+        default=None,
+        help="result file; default: a new file in resdir",
+    )
+    argp.add_argument(
+        "-format",
+        action="store",
+        dest="format",
+        default=CSV,
+        help="default: csv\nAvailable: csv | npz",
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="ERROR",
+        help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+
+    args = argp.parse_args()
+    samples_file = os.getenv("samples_list", args.samples)
+    profile_file = os.getenv("traffic_profile", args.profile)
+    replay_file = os.getenv("replay_file", args.replay)
+    time_factor = os.getenv("time_factor", args.time_factor)
+    mode = os.getenv("mode", args.mode).lower()
+    resdir = os.getenv("resdir", args.resdir)
+    loglevel = os.getenv("log_level", args.log)
+    result_format = os.getenv("result_format", args.format).lower()
+    elevator_count = os.getenv("elevator_count", args.elevators)
+    floor_count = os.getenv("floor_count", args.floors)
+    seed = None if args.seed is None else int(args.seed)
+
+    logging.basicConfig(level=getattr(logging, loglevel.upper()))
+
+    profile = None
+    if profile_file and not replay_file:
+        profile = load_profile(profile_file)
+        # a profile is made for its building, e.g. its O-D matrix
+        floor_count = profile.setdefault("floors", int(floor_count))
+
+    sim = Simulation(
+        mode,
+        seed=seed,
+        elevator_count=int(elevator_count),
+        floor_count=int(floor_count),
+    )
+    if replay_file:
+        sim.add_stream(replay_trace(replay_file, time_factor=float(time_factor)))
+    elif profile is not None:
+        sim.add_stream(generate_traffic(profile, seed=seed))
+    else:
+        sim.add_scenario(timeline_entries(load_timeline(samples_file)))
+
+    started = time.perf_counter()
+    records = sim.run(until=float(args.until))
+    elapsed = time.perf_counter() - started
+
+    resname = os.getenv("result_file", args.out)
+    if resname is None:
+        if not os.path.exists(resdir):
+            os.makedirs(resdir)
+        # runs of a sweep script finish many times per second
+        now = dt.now().strftime("%F-%H:%M:%S.%f")
+        resname = f"{resdir}/log-{mode}-{now}.{result_format}"
+    if result_format == NPZ:
+        metadata = {
+            "mode": mode,
+            "scenario": replay_file or profile_file or samples_file,
+            "seed": seed,
+            "elevator_count": int(elevator_count),
+            "floor_count": int(floor_count),
+            "started": sim.epoch.isoformat(),
+        }
+        ResultWriter(resname, metadata).write(records)
+    else:
+        with open(resname, mode="x", newline="") as resfile:
+            writer = csv.DictWriter(resfile, RECORD_FIELDS)
+            writer.writeheader()
+            writer.writerows(p.to_dict() for p in records)
+
+    print(
+        f"arrived {len(records)}/{sim.expected} passengers after {sim.now:.1f}s "
+        f"simulated in {elapsed * 1000:.0f}ms; wrote {resname}"
+    )
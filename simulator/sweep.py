@@ -0,0 +1,244 @@
+# sweep.py
+
+import os
+import csv
+import glob
+import time
+import logging
+import argparse
+import itertools
+import numpy as np
+
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from cps_common.analysis import columns_from_passengers, summary
+from cps_common.data import Passenger, ELEVATOR_COUNT, FLOOR_COUNT
+from cps_common.simulation import Simulation
+from cps_common.timeline import load_timeline, timeline_entries
+from cps_common.scheduling import (
+    SMART,
+    DUMB,
+    SMARTER_DUMB,
+    SMART_WITH_CAP,
+    ETA,
+    DESTINATION,
+    MULTIPLE_ELEVATOR_THRESHOLD,
+    MAX_ELEVATOR_PER_FLOOR,
+)
+
+COLUMNS = [
+    "mode",
+    "scenario",
+    "threshold",
+    "max_per_floor",
+    "seed",
+    "arrived",
+    "expected",
+    "avg_wait",
+    "p95_wait",
+    "avg_ride",
+    "p95_ride",
+    "avg_journey",
+    "sim_time",
+]
+
+
+@lru_cache(maxsize=None)
+def get_scenario(path: str) -> np.ndarray:
+    # each worker process maps every compiled scenario only once
+    return load_timeline(path)
+
+
+def summarize(records: List[Passenger]) -> dict:
+    kpis = summary(columns_from_passengers(records))
+    return {
+        "avg_wait": kpis["wait"]["mean"],
+        "p95_wait": kpis["wait"]["p95"],
+        "avg_ride": kpis["ride"]["mean"],
+        "p95_ride": kpis["ride"]["p95"],
+        "avg_journey": kpis["journey"]["mean"],
+    }
+
+
+def run_cell(cell: dict) -> dict:
+    """Runs one simulation of the sweep grid in this process."""
+    sim = Simulation(
+        cell["mode"],
+        seed=cell["seed"],
+        elevator_count=cell["elevators"],
+        floor_count=cell["floors"],
+        multiple_elevator_threshold=cell["threshold"],
+        max_elevator_per_floor=cell["max_per_floor"],
+    )
+    sim.add_scenario(timeline_entries(get_scenario(cell["path"])))
+    records = sim.run(until=cell["until"])
+
+    result = dict(cell)
+    result.update(summarize(records))
+    result.update(
+        arrived=len(records), expected=sim.expected, sim_time=float(sim.now)
+    )
+    return result
+
+
+def build_grid(
+    modes: List[str],
+    scenarios: List[str],
+    thresholds: List[int],
+    max_per_floor: List[int],
+    seeds: List[int],
+    until: float,
+    elevators: int = ELEVATOR_COUNT,
+    floors: int = FLOOR_COUNT,
+) -> List[dict]:
+    return [
+        {
+            "mode": m,
+            "scenario": os.path.splitext(os.path.basename(s))[0],
+            "path": s,
+            "threshold": t,
+            "max_per_floor": c,
+            "seed": seed,
+            "until": until,
+            "elevators": elevators,
+            "floors": floors,
+        }
+        for m, s, t, c, seed in itertools.product(
+            modes, scenarios, thresholds, max_per_floor, seeds
+        )
+    ]
+
+
+def format_table(results: List[dict]) -> str:
+    def fmt(v):
+        if v is None:
+            return "-"
+        if isinstance(v, float):
+            return f"{v:.1f}"
+        return str(v)
+
+    rows = [COLUMNS] + [[fmt(r[c]) for c in COLUMNS] for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return "\n".join(
+        "  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in rows
+    )
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Scheduling Parameter Sweep")
+    argp.add_argument(
+        "-samples",
+        action="store",
+        dest="samples",
+        default="../input-feeder/samples/*.yaml",
+        help="glob of passenger samples; default: ../input-feeder/samples/*.yaml",
+    )
+    argp.add_argument(
+        "-modes",
+        action="store",
+        dest="modes",
+        default=",".join([SMART, DUMB, SMARTER_DUMB, SMART_WITH_CAP, ETA, DESTINATION]),
+        help="comma separated; default: all modes",
+    )
+    argp.add_argument(
+        "-thresholds",
+        action="store",
+        dest="thresholds",
+        default=str(MULTIPLE_ELEVATOR_THRESHOLD),
+        help=f"comma separated MULTIPLE_ELEVATOR_THRESHOLD values; "
+        f"default: {MULTIPLE_ELEVATOR_THRESHOLD}",
+    )
+    argp.add_argument(
+        "-maxperfloor",
+        action="store",
+        dest="maxperfloor",
+        default=str(MAX_ELEVATOR_PER_FLOOR),
+        help=f"comma separated MAX_ELEVATOR_PER_FLOOR values; "
+        f"default: {MAX_ELEVATOR_PER_FLOOR}",
+    )
+    argp.add_argument(
+        "-elevators",
+        action="store",
+        dest="elevators",
+        default=ELEVATOR_COUNT,
+        help=f"number of elevators; default: {ELEVATOR_COUNT}",
+    )
+    argp.add_argument(
+        "-floors",
+        action="store",
+        dest="floors",
+        default=FLOOR_COUNT,
+        help=f"number of floors; default: {FLOOR_COUNT}",
+    )
+    argp.add_argument(
+        "-seeds", action="store", dest="seeds", default="0", help="default: 0",
+    )
+    argp.add_argument(
+        "-until",
+        action="store",
+        dest="until",
+        default=3600,
+        help="stop each run after this many simulated seconds; default: 3600",
+    )
+    argp.add_argument(
+        "-workers",
+        action="store",
+        dest="workers",
+        default=None,
+        help="number of processes; default: number of cores",
+    )
+    argp.add_argument(
+        "-out", action="store", dest="out", default=None, help="write results as CSV",
+    )
+    argp.add_argument(
+        "-log",
+        action="store",
+        dest="log",
+        default="ERROR",
+        help="default: ERROR\nAvailable: INFO DEBUG WARNING ERROR CRITICAL",
+    )
+
+    args = argp.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    scenarios = []
+    for path in sorted(glob.glob(args.samples)):
+        try:
+            get_scenario(path)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"skipping {path}: unsupported scenario format ({e})")
+            continue
+        scenarios.append(path)
+
+    grid = build_grid(
+        modes=args.modes.split(","),
+        scenarios=scenarios,
+        thresholds=int_list(args.thresholds),
+        max_per_floor=int_list(args.maxperfloor),
+        seeds=int_list(args.seeds),
+        until=float(args.until),
+        elevators=int(args.elevators),
+        floors=int(args.floors),
+    )
+
+    workers = os.cpu_count() if args.workers is None else int(args.workers)
+    # hand out several cells at once, most runs take only a few milliseconds
+    chunksize = max(1, len(grid) // (4 * workers))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_cell, grid, chunksize=chunksize))
+    elapsed = time.perf_counter() - started
+
+    print(format_table(results))
+    print(f"\n{len(results)} runs in {elapsed:.2f}s")
+
+    if args.out is not None:
+        with open(args.out, mode="w", newline="") as f:
+            writer = csv.DictWriter(f, COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)